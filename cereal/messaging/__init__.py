@@ -7,15 +7,19 @@ import msgq
 
 import os
 import capnp
+import heapq
+import numpy as np
 import time
 
-from typing import Optional, List, Union, Dict, Deque
-from collections import deque
+from typing import Optional, List, Set, Tuple, Union, Dict
 
 from cereal import log
 from cereal.services import SERVICE_LIST
+from cereal.messaging.tracing import TRACE, trace_publish, trace_receive
 
 NO_TRAVERSAL_LIMIT = 2**64-1
+# receive times at or before this are taken as unset
+MIN_RECV_TIME_NS = 10_000
 
 
 def reset_context():
@@ -27,12 +31,15 @@ def log_from_bytes(dat: bytes, struct: capnp.lib.capnp._StructModule = log.Event
     return msg
 
 
-def new_message(service: Optional[str], size: Optional[int] = None, **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
+def new_message(service: Optional[str], size: Optional[int] = None, num_first_segment_words: Optional[int] = None,
+                **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
   args = {
     'valid': False,
     'logMonoTime': int(time.monotonic() * 1e9),
     **kwargs
   }
+  if num_first_segment_words is not None:
+    args['num_first_segment_words'] = num_first_segment_words
   dat = log.Event.new_message(**args)
   if service is not None:
     if size is None:
@@ -42,32 +49,43 @@ def new_message(service: Optional[str], size: Optional[int] = None, **kwargs) ->
   return dat
 
 
+class LazyMessages:
+  """Raw received messages, each one only parsed the first time it's accessed"""
+
+  def __init__(self, dats: List[bytes]):
+    self.raw = dats
+    self._msgs: List[Optional[capnp.lib.capnp._DynamicStructReader]] = [None] * len(dats)
+
+  def __len__(self) -> int:
+    return len(self.raw)
+
+  def __getitem__(self, i: int) -> capnp.lib.capnp._DynamicStructReader:
+    msg = self._msgs[i]
+    if msg is None:
+      msg = self._msgs[i] = log_from_bytes(self.raw[i])
+    return msg
+
+  def __iter__(self):
+    for i in range(len(self.raw)):
+      yield self[i]
+
+
 def drain_sock(sock: SubSocket, wait_for_one: bool = False) -> List[capnp.lib.capnp._DynamicStructReader]:
   """Receive all message currently available on the queue"""
   msgs = drain_sock_raw(sock, wait_for_one=wait_for_one)
   return [log_from_bytes(m) for m in msgs]
 
 
+def drain_sock_lazy(sock: SubSocket, wait_for_one: bool = False, max_n: int = -1) -> LazyMessages:
+  """Same as drain_sock, receiving up to max_n messages in one call and leaving the parsing to when they're accessed"""
+  return LazyMessages(sock.recv_many(max_n, wait_for_one))
+
+
 # TODO: print when we drop packets?
 def recv_sock(sock: SubSocket, wait: bool = False) -> Optional[capnp.lib.capnp._DynamicStructReader]:
   """Same as drain sock, but only returns latest message. Consider using conflate instead."""
-  dat = None
-
-  while 1:
-    if wait and dat is None:
-      recv = sock.receive()
-    else:
-      recv = sock.receive(non_blocking=True)
-
-    if recv is None:  # Timeout hit
-      break
-
-    dat = recv
-
-  if dat is not None:
-    dat = log_from_bytes(dat)
-
-  return dat
+  msgs = drain_sock_raw(sock, wait_for_one=wait)
+  return log_from_bytes(msgs[-1]) if len(msgs) else None
 
 
 def recv_one(sock: SubSocket) -> Optional[capnp.lib.capnp._DynamicStructReader]:
@@ -93,7 +111,7 @@ def recv_one_retry(sock: SubSocket) -> capnp.lib.capnp._DynamicStructReader:
 
 
 class FrequencyTracker:
-  def __init__(self, service_freq: float, update_freq: float, is_poll: bool):
+  def __init__(self, service_freq: float, update_freq: float, is_poll: bool, recv_times: Optional[np.ndarray] = None):
     freq = max(min(service_freq, update_freq), 1.)
     if is_poll:
       min_freq = max_freq = freq
@@ -108,41 +126,67 @@ class FrequencyTracker:
 
     self.min_freq = min_freq * 0.8
     self.max_freq = max_freq * 1.2
-    self.recv_dts: Deque[float] = deque(maxlen=int(10 * freq))
-    self.recv_dts_sum = 0.0
-    self.recent_recv_dts: Deque[float] = deque(maxlen=int(freq))
-    self.recent_recv_dts_sum = 0.0
-    self.prev_time = 0.0
+    self.max_dts = int(10 * freq)
+    self.max_recent_dts = int(freq)
+
+    # ring buffer of the last receive times in integer nanoseconds, the sum of any run of dts between them is
+    # just the difference of two times, so the averages are constant time and don't drift
+    size = self.buffer_size(service_freq, update_freq)
+    self.recv_times = np.zeros(size, dtype=np.int64) if recv_times is None else recv_times
+    assert self.recv_times.shape == (size,) and self.recv_times.dtype == np.int64
+    self.last = -1
+    self.num_times = 0
+    self.prev_time = 0
+
+  @staticmethod
+  def buffer_size(service_freq: float, update_freq: float) -> int:
+    return int(10 * max(min(service_freq, update_freq), 1.)) + 1
 
   def record_recv_time(self, cur_time: float) -> None:
     # TODO: Handle case where cur_time is less than prev_time
-    if self.prev_time > 1e-5:
-      dt = cur_time - self.prev_time
+    t = int(cur_time * 1e9)
+    if self.prev_time <= MIN_RECV_TIME_NS:
+      self.num_times = 0
 
-      if len(self.recv_dts) == self.recv_dts.maxlen:
-        self.recv_dts_sum -= self.recv_dts[0]
-      self.recv_dts.append(dt)
-      self.recv_dts_sum += dt
+    self.last = (self.last + 1) % len(self.recv_times)
+    self.recv_times[self.last] = t
+    self.num_times += 1
+    self.prev_time = t
 
-      if len(self.recent_recv_dts) == self.recent_recv_dts.maxlen:
-        self.recent_recv_dts_sum -= self.recent_recv_dts[0]
-      self.recent_recv_dts.append(dt)
-      self.recent_recv_dts_sum += dt
+  @property
+  def num_dts(self) -> int:
+    return min(self.num_times - 1, self.max_dts)
 
-    self.prev_time = cur_time
+  def _avg_freq(self, n: int) -> float:
+    span = self.prev_time - int(self.recv_times[(self.last - n) % len(self.recv_times)])
+    return n * 1e9 / span if span > 0 else 0.
 
   @property
   def valid(self) -> bool:
-    if not self.recv_dts:
+    n = self.num_dts
+    if n < 1:
       return False
 
-    avg_freq = len(self.recv_dts) / self.recv_dts_sum
+    avg_freq = self._avg_freq(n)
     if self.min_freq <= avg_freq <= self.max_freq:
       return True
 
-    avg_freq_recent = len(self.recent_recv_dts) / self.recent_recv_dts_sum
+    avg_freq_recent = self._avg_freq(min(n, self.max_recent_dts))
     return self.min_freq <= avg_freq_recent <= self.max_freq
 
+  def recv_dts(self) -> np.ndarray:
+    """Time between the last receives in seconds, oldest first"""
+    n = self.num_dts
+    if n < 1:
+      return np.zeros(0)
+    times = self.recv_times[(self.last - np.arange(n, -1, -1)) % len(self.recv_times)]
+    return np.diff(times) / 1e9
+
+  def recv_dt_percentiles(self, q=(50., 99.)) -> Optional[np.ndarray]:
+    """Percentiles of the time between receives (p50/p99 by default), to catch timing jitter before the average is off"""
+    dts = self.recv_dts()
+    return np.percentile(dts, q) if len(dts) else None
+
 
 class SubMaster:
   def __init__(self, services: List[str], poll: Optional[str] = None,
@@ -172,11 +216,23 @@ class SubMaster:
 
     self.simulation = bool(int(os.getenv("SIMULATION", "0")))
 
+    # services whose alive and freq_ok are checked, with the delay after which they're not alive anymore
+    self.alive_timeout = {s: 10. / SERVICE_LIST[s].frequency for s in services if SERVICE_LIST[s].frequency > 1e-5 and not self.simulation}
+    # (deadline, service) of each alive checked service, past its deadline it's dead unless received since
+    self.alive_deadlines: List[Tuple[float, str]] = []
+    self.alive_deadline_services: Set[str] = set()
+    self.updated_services: List[str] = []
+
     # if freq and poll aren't specified, assume the max to be conservative
     assert frequency is None or poll is None, "Do not specify 'frequency' - frequency of the polled service will be used."
     self.update_freq = frequency or max([SERVICE_LIST[s].frequency for s in polled_services])
 
-    for s in services:
+    # the receive times of all services share one buffer
+    buffer_sizes = [FrequencyTracker.buffer_size(SERVICE_LIST[s].frequency, self.update_freq) for s in services]
+    self.recv_times = np.zeros(sum(buffer_sizes), dtype=np.int64)
+    recv_times_offsets = np.cumsum([0] + buffer_sizes)
+
+    for i, s in enumerate(services):
       p = self.poller if s not in self.non_polled_services else None
       self.sock[s] = sub_sock(s, poller=p, addr=addr, conflate=True)
 
@@ -188,7 +244,8 @@ class SubMaster:
       self.data[s] = getattr(data.as_reader(), s)
       self.logMonoTime[s] = 0
       self.valid[s] = False
-      self.freq_tracker[s] = FrequencyTracker(SERVICE_LIST[s].frequency, self.update_freq, s == poll)
+      recv_times = self.recv_times[recv_times_offsets[i]:recv_times_offsets[i + 1]]
+      self.freq_tracker[s] = FrequencyTracker(SERVICE_LIST[s].frequency, self.update_freq, s == poll, recv_times)
 
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
     return self.data[s]
@@ -208,7 +265,11 @@ class SubMaster:
 
   def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
     self.frame += 1
-    self.updated = dict.fromkeys(self.services, False)
+    # only services updated last time can need resetting
+    for s in self.updated_services:
+      self.updated[s] = False
+    self.updated_services.clear()
+
     for msg in msgs:
       if msg is None:
         continue
@@ -216,6 +277,9 @@ class SubMaster:
       s = msg.which()
       self.seen[s] = True
       self.updated[s] = True
+      self.updated_services.append(s)
+      if TRACE:
+        trace_receive(s, msg.logMonoTime)
 
       self.freq_tracker[s].record_recv_time(cur_time)
       self.recv_time[s] = cur_time
@@ -224,14 +288,48 @@ class SubMaster:
       self.logMonoTime[s] = msg.logMonoTime
       self.valid[s] = msg.valid
 
+    if self.frame == 0:
+      self._check_all(cur_time)
+      return
+
+    # freq_ok only changes when a service is received, and alive when it is received or goes past its deadline
+    for s in self.updated_services:
+      if s in self.alive_timeout:
+        self.freq_ok[s] = self.freq_tracker[s].valid
+        if s not in self.alive_deadline_services:
+          heapq.heappush(self.alive_deadlines, (cur_time + self.alive_timeout[s], s))
+          self.alive_deadline_services.add(s)
+        self.alive[s] = True
+      elif self.simulation:
+        self.alive[s] = True
+
+    still_alive = []
+    while len(self.alive_deadlines) and self.alive_deadlines[0][0] <= cur_time:
+      _, s = heapq.heappop(self.alive_deadlines)
+      # alive if delay is within 10x the expected frequency
+      if (cur_time - self.recv_time[s]) < self.alive_timeout[s]:
+        still_alive.append((self.recv_time[s] + self.alive_timeout[s], s))
+      else:
+        self.alive[s] = False
+        self.alive_deadline_services.discard(s)
+    for deadline in still_alive:
+      heapq.heappush(self.alive_deadlines, deadline)
+
+  def _check_all(self, cur_time: float) -> None:
+    self.alive_deadlines.clear()
+    self.alive_deadline_services.clear()
     for s in self.services:
-      if SERVICE_LIST[s].frequency > 1e-5 and not self.simulation:
+      if s in self.alive_timeout:
         # alive if delay is within 10x the expected frequency
-        self.alive[s] = (cur_time - self.recv_time[s]) < (10. / SERVICE_LIST[s].frequency)
+        self.alive[s] = (cur_time - self.recv_time[s]) < self.alive_timeout[s]
         self.freq_ok[s] = self.freq_tracker[s].valid
+        if self.alive[s]:
+          self.alive_deadlines.append((self.recv_time[s] + self.alive_timeout[s], s))
+          self.alive_deadline_services.add(s)
       else:
         self.freq_ok[s] = True
         self.alive[s] = self.seen[s] if self.simulation else True
+    heapq.heapify(self.alive_deadlines)
 
   def all_alive(self, service_list: Optional[List[str]] = None) -> bool:
     return all(self.alive[s] for s in (service_list or self.services) if s not in self.ignore_alive)
@@ -249,14 +347,29 @@ class SubMaster:
 class PubMaster:
   def __init__(self, services: List[str]):
     self.sock = {}
+    # serialized size of the last message sent on each service, in words
+    self.msg_words: Dict[str, int] = {}
     for s in services:
       self.sock[s] = pub_sock(s)
 
-  def send(self, s: str, dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder]) -> None:
-    if not isinstance(dat, bytes):
+  def new_message(self, s: str, size: Optional[int] = None, **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
+    """
+    Same as messaging.new_message, with the first segment sized after the last message sent on s. A service whose
+    messages are about the same size every cycle then gets built in a single allocation and serialized from one segment.
+    """
+    return new_message(s, size, num_first_segment_words=self.msg_words.get(s), **kwargs)
+
+  def send(self, s: str, dat: Union[bytes, bytearray, memoryview, capnp.lib.capnp._DynamicStructBuilder]) -> None:
+    msg = dat
+    if isinstance(dat, capnp.lib.capnp._DynamicStructBuilder):
       dat = dat.to_bytes()
+      self.msg_words[s] = len(dat) // 8
     self.sock[s].send(dat)
 
+    if TRACE:
+      # bytes of bytes is the same object, only bytearrays and memoryviews are copied
+      trace_publish(s, msg if isinstance(msg, capnp.lib.capnp._DynamicStructBuilder) else log_from_bytes(bytes(msg)))
+
   def wait_for_readers_to_update(self, s: str, timeout: int, dt: float = 0.05) -> bool:
     for _ in range(int(timeout*(1./dt))):
       if self.sock[s].all_readers_updated():
@@ -0,0 +1,264 @@
+"""
+Latency tracing across processes. With LATENCY_TRACE=1, every PubMaster.send and every message a SubMaster receives is
+recorded in a ring buffer in shared memory, one per process. A TraceReader collects the records of all processes live,
+and LatencyChains follows each camera frame through the pipeline to get its end-to-end latency. camerad isn't traced,
+being C++, so frames are followed from modelV2, which has the frameId and the camera's end of frame time.
+"""
+import atexit
+import glob
+import itertools
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cereal.services import SERVICE_LIST
+
+TRACE = bool(int(os.getenv("LATENCY_TRACE", "0")))
+TRACE_RING_SIZE = 8192  # records per process, several seconds of everything a process publishes and receives
+
+PUBLISH, RECEIVE = 1, 2
+
+SERVICES = list(SERVICE_LIST.keys())
+SERVICE_IDS = {s: i for i, s in enumerate(SERVICES)}
+
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([('count', '<u8')])
+# seq is written first and seq_end last, a record that is being written has them differ
+TRACE_DTYPE = np.dtype([('seq', '<u8'), ('kind', 'u1'), ('service', '<u2'), ('time', '<i8'), ('log_mono_time', '<i8'),
+                        ('ref', '<i8'), ('t0', '<i8'), ('seq_end', '<u8')])
+
+# field of a published message pointing back to the camera frame it comes from: the frameId itself, or the
+# logMonoTime of the upstream message it was computed from
+TRACE_REFS = {
+  'modelV2': 'frameId',
+  'longitudinalPlan': 'modelMonoTime',
+  'controlsState': 'longitudinalPlanMonoTime',
+}
+# camera timestamp the chain of a frame starts at, comparable to logMonoTime like in latency_logger.py
+TRACE_T0 = {'modelV2': 'timestampEof'}
+
+# camera end of frame -> modeld -> plannerd -> controlsd -> card
+CHAIN = ['modelV2', 'longitudinalPlan', 'controlsState', 'sendcan']
+LATENCY_BIN_MS = 1.
+MAX_LATENCY_MS = 500.  # the last bin also counts everything above
+
+
+def trace_dir() -> str:
+  # next to the msgq queues
+  return os.path.join("/dev/shm", os.getenv("OPENPILOT_PREFIX", ""), "latency_trace")
+
+
+def _pid_alive(pid: int) -> bool:
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+
+def remove_stale_rings() -> None:
+  """Remove the rings of processes that died without cleaning up after themselves, e.g. killed by SIGKILL"""
+  for path in glob.glob(os.path.join(trace_dir(), "*")):
+    name = os.path.basename(path)
+    if name.isdigit() and not _pid_alive(int(name)):
+      try:
+        os.unlink(path)
+      except FileNotFoundError:
+        pass
+
+
+class TraceWriter:
+  """Ring buffer of this process' records. Lock free: slots are claimed from an atomic counter, readers check seq"""
+
+  def __init__(self, size: int = TRACE_RING_SIZE):
+    self.pid = os.getpid()
+    os.makedirs(trace_dir(), exist_ok=True)
+    remove_stale_rings()
+    self.path = os.path.join(trace_dir(), str(self.pid))
+    with open(self.path, "wb") as f:
+      f.truncate(HEADER_SIZE + size * TRACE_DTYPE.itemsize)
+    self.header = np.memmap(self.path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+    self.records = np.memmap(self.path, dtype=TRACE_DTYPE, mode="r+", offset=HEADER_SIZE, shape=(size,))
+    self.seq = itertools.count(1)
+    atexit.register(self.close)
+
+  def record(self, kind: int, service: str, log_mono_time: int, ref: int = -1, t0: int = -1) -> None:
+    seq = next(self.seq)
+    self.records[seq % len(self.records)] = (seq, kind, SERVICE_IDS[service], time.monotonic_ns(), log_mono_time, ref, t0, seq)
+    self.header[0] = (seq,)
+
+  def close(self) -> None:
+    try:
+      os.unlink(self.path)
+    except FileNotFoundError:
+      pass
+
+
+_writer: Optional[TraceWriter] = None
+
+
+def get_writer() -> TraceWriter:
+  global _writer
+  # forked processes get their own ring
+  if _writer is None or _writer.pid != os.getpid():
+    _writer = TraceWriter()
+  return _writer
+
+
+def trace_publish(s: str, msg) -> None:
+  """Record msg, an event builder or reader, as published on s"""
+  ref = t0 = -1
+  if s in TRACE_REFS:
+    dat = getattr(msg, s)
+    ref = getattr(dat, TRACE_REFS[s])
+    if s in TRACE_T0:
+      t0 = getattr(dat, TRACE_T0[s])
+  get_writer().record(PUBLISH, s, msg.logMonoTime, ref, t0)
+
+
+def trace_receive(s: str, log_mono_time: int) -> None:
+  get_writer().record(RECEIVE, s, log_mono_time)
+
+
+class TraceReader:
+  """Reads the records written since the last read by all traced processes"""
+
+  def __init__(self):
+    self.rings: Dict[str, Tuple[np.memmap, np.memmap]] = {}
+    self.last_seq: Dict[str, int] = {}
+    remove_stale_rings()
+
+  def _open(self, path: str) -> Optional[Tuple[np.memmap, np.memmap]]:
+    if path not in self.rings:
+      try:
+        header = np.memmap(path, dtype=HEADER_DTYPE, mode="r", shape=(1,))
+        records = np.memmap(path, dtype=TRACE_DTYPE, mode="r", offset=HEADER_SIZE)
+      except (OSError, ValueError):
+        return None
+      self.rings[path] = (header, records)
+    return self.rings[path]
+
+  def read(self) -> np.ndarray:
+    """New records, sorted by time"""
+    paths = set(glob.glob(os.path.join(trace_dir(), "*")))
+    for path in set(self.rings) - paths:
+      # the process exited
+      del self.rings[path]
+      self.last_seq.pop(path, None)
+
+    new = []
+    for path in paths:
+      ring = self._open(path)
+      if ring is None:
+        continue
+      header, records = ring
+
+      count, last = int(header[0]['count']), self.last_seq.get(path, 0)
+      if count < last:
+        # new process with the same pid
+        last = 0
+      if count == last:
+        continue
+
+      seqs = np.arange(max(last + 1, count - len(records) + 1), count + 1, dtype=np.uint64)
+      recs = np.array(records[seqs % len(records)])
+      new.append(recs[(recs['seq'] == seqs) & (recs['seq_end'] == seqs)])
+      self.last_seq[path] = count
+
+    if not len(new):
+      return np.zeros(0, dtype=TRACE_DTYPE)
+    recs = np.concatenate(new)
+    return recs[np.argsort(recs['time'], kind='stable')]
+
+
+class LatencyHistogram:
+  def __init__(self):
+    self.counts = np.zeros(int(MAX_LATENCY_MS / LATENCY_BIN_MS) + 1, dtype=np.int64)
+
+  def add(self, ms: float) -> None:
+    self.counts[min(max(int(ms / LATENCY_BIN_MS), 0), len(self.counts) - 1)] += 1
+
+  def percentile(self, q: float) -> Optional[float]:
+    """Upper edge of the bin holding the q-th percentile, in ms"""
+    total = self.counts.sum()
+    if total == 0:
+      return None
+    return float(np.searchsorted(np.cumsum(self.counts), total * q / 100.) + 1) * LATENCY_BIN_MS
+
+
+class LatencyChains:
+  """
+  Follows camera frames through CHAIN from trace records: modelV2 carries the frameId and the end of frame time,
+  longitudinalPlan and controlsState the logMonoTime of what they were computed from, and sendcan is the first one card
+  sends after the carControl that follows controlsState.
+  """
+
+  def __init__(self, max_frames: int = 100):
+    self.max_frames = max_frames
+    self.frames: OrderedDict[int, Dict[str, int]] = OrderedDict()
+    self.mono_to_frame: OrderedDict[int, int] = OrderedDict()
+    self.pub_times: OrderedDict[Tuple[int, int], int] = OrderedDict()
+    self.controls_frame: Optional[int] = None
+    self.sendcan_frame: Optional[int] = None
+
+    # from end of frame to each stage being published
+    self.histograms = {s: LatencyHistogram() for s in CHAIN}
+    # from publish to receive, per service
+    self.delivery_histograms: Dict[str, LatencyHistogram] = {}
+
+  def _set_stage(self, frame: Optional[int], s: str, t: int) -> None:
+    if frame is not None and frame in self.frames:
+      self.frames[frame][s] = t
+
+  def _link(self, log_mono_time: int, frame: Optional[int]) -> None:
+    if frame is not None:
+      self.mono_to_frame[log_mono_time] = frame
+      if len(self.mono_to_frame) > 10 * self.max_frames:
+        self.mono_to_frame.popitem(last=False)
+
+  def update(self, records: np.ndarray) -> List[Tuple[int, Dict[str, float]]]:
+    """Add new records, returns the frames whose chain completed with the ms from end of frame to each stage"""
+    done = []
+    for r in records:
+      sid, t, log_mono_time = int(r['service']), int(r['time']), int(r['log_mono_time'])
+      s = SERVICES[sid]
+
+      if r['kind'] == RECEIVE:
+        pub_time = self.pub_times.get((sid, log_mono_time))
+        if pub_time is not None:
+          self.delivery_histograms.setdefault(s, LatencyHistogram()).add((t - pub_time) / 1e6)
+        continue
+
+      self.pub_times[(sid, log_mono_time)] = t
+      if len(self.pub_times) > 100 * self.max_frames:
+        self.pub_times.popitem(last=False)
+
+      if s == 'modelV2':
+        frame_id = int(r['ref'])
+        self.frames[frame_id] = {'start': int(r['t0']) if r['t0'] > 0 else t, s: t}
+        if len(self.frames) > self.max_frames:
+          self.frames.popitem(last=False)
+        self._link(log_mono_time, frame_id)
+      elif s in ('longitudinalPlan', 'controlsState'):
+        frame = self.mono_to_frame.get(int(r['ref']))
+        self._set_stage(frame, s, t)
+        self._link(log_mono_time, frame)
+        if s == 'controlsState':
+          self.controls_frame = frame
+      elif s == 'carControl':
+        self.sendcan_frame, self.controls_frame = self.controls_frame, None
+      elif s == 'sendcan' and self.sendcan_frame is not None:
+        frame, self.sendcan_frame = self.sendcan_frame, None
+        stages = self.frames.pop(frame, None)
+        if stages is not None and all(c in stages for c in CHAIN[:-1]):
+          stages[s] = t
+          latencies = {c: (stages[c] - stages['start']) / 1e6 for c in CHAIN}
+          for c, ms in latencies.items():
+            self.histograms[c].add(ms)
+          done.append((frame, latencies))
+    return done
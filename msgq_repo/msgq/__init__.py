@@ -46,16 +46,5 @@ def sub_sock(endpoint: str, poller: Optional[Poller] = None, addr: str = "127.0.
 
 def drain_sock_raw(sock: SubSocket, wait_for_one: bool = False) -> List[bytes]:
   """Receive all message currently available on the queue"""
-  ret: List[bytes] = []
-  while 1:
-    if wait_for_one and len(ret) == 0:
-      dat = sock.receive()
-    else:
-      dat = sock.receive(non_blocking=True)
-
-    if dat is None:
-      break
-
-    ret.append(dat)
-
+  ret: List[bytes] = sock.recv_many(-1, wait_for_one)
   return ret
@@ -7,6 +7,7 @@ from libcpp.vector cimport vector
 from libcpp cimport bool
 from libc cimport errno
 from libc.string cimport strerror
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_GET_SIZE
 from cython.operator import dereference
 
 
@@ -212,6 +213,27 @@ cdef class SubSocket:
 
       return m
 
+  def recv_many(self, int max_n=-1, bool wait_for_one=False):
+    """Receive up to max_n (all if negative) of the queued messages in one call, waiting for the first one if wait_for_one"""
+    cdef list ret = []
+    cdef cppMessage * msg
+    cdef bool non_blocking
+
+    while max_n < 0 or len(ret) < max_n:
+      non_blocking = not wait_for_one or len(ret) > 0
+      msg = self.socket.receive(non_blocking)
+
+      if msg == NULL:
+        if not non_blocking and errno.errno == errno.EINTR:
+          print("SIGINT received, exiting")
+          sys.exit(1)
+        break
+
+      ret.append(msg.getData()[:msg.getSize()])
+      del msg
+
+    return ret
+
 
 cdef class PubSocket:
   cdef cppPubSocket * socket
@@ -233,9 +255,20 @@ cdef class PubSocket:
       else:
         raise IpcError(endpoint)
 
-  def send(self, bytes data):
-    length = len(data)
-    r = self.socket.send(<char*>data, length)
+  def send(self, data):
+    cdef const unsigned char[::1] view
+    cdef char* buf
+    cdef Py_ssize_t length
+
+    if isinstance(data, bytes):
+      buf, length = PyBytes_AS_STRING(data), PyBytes_GET_SIZE(data)
+    else:
+      # any other contiguous buffer, so messages can be sent straight from a bytearray or memoryview without making
+      # bytes of it. Acquiring the buffer costs more than reading a bytes object, which most messages are
+      view = data
+      length = view.shape[0]
+      buf = <char*>&view[0] if length > 0 else NULL
+    r = self.socket.send(buf, length)
 
     if r != length:
       if errno.errno == errno.EADDRINUSE:
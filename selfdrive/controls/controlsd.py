@@ -169,7 +169,7 @@ class Controls:
     #       sm.all_checks(), but this creates a circular dependency
 
     # controlsState
-    dat = messaging.new_message('controlsState')
+    dat = self.pm.new_message('controlsState')
     dat.valid = CS.canValid
     cs = dat.controlsState
 
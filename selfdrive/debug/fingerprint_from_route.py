@@ -42,5 +42,5 @@ if __name__ == "__main__":
     print("Usage: ./fingerprint_from_route.py <route>")
     sys.exit(1)
 
-  lr = LogReader(sys.argv[1], ReadMode.QLOG)
+  lr = LogReader(sys.argv[1], ReadMode.QLOG, services={'carParams', 'can'}, use_index=True)
   get_fingerprint(lr)
@@ -10,7 +10,7 @@ from opendbc.car.car_helpers import interface_names
 from opendbc.car.fingerprints import MIGRATION
 from opendbc.car.fw_versions import VERSIONS, match_fw_to_car
 from openpilot.tools.lib.logreader import LogReader, ReadMode
-from openpilot.tools.lib.route import SegmentRange
+from openpilot.tools.lib.route import SegmentRange, get_routes
 
 
 NO_API = "NO_API" in os.environ
@@ -25,10 +25,14 @@ if __name__ == "__main__":
   args = parser.parse_args()
 
   if os.path.exists(args.route):
-    routes = list(open(args.route))
+    routes = [line.strip() for line in open(args.route) if line.strip()]
   else:
     routes = [args.route]
 
+  if not NO_API:
+    # resolve all routes concurrently up front, the results are cached for the LogReaders below
+    get_routes(SegmentRange(route).route_name for route in routes)
+
   mismatches = defaultdict(list)
 
   not_fingerprinted = 0
@@ -231,7 +231,7 @@ if __name__ == "__main__":
   args = parser.parse_args()
 
   r = DEMO_ROUTE if args.demo else args.route_or_segment_name.strip()
-  lr = LogReader(r, sort_by_time=True)
+  lr = LogReader(r, sort_by_time=True, services={*MSGQ_TO_SERVICE, 'sendcan', 'logMessage'}, use_index=True)
 
   data, _ = get_timestamps(lr)
   print_timestamps(data['timestamp'], data['duration'], data['start'], args.relative)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from cereal.messaging.tracing import CHAIN, LatencyChains, TraceReader
+
+
+def print_summary(chains: LatencyChains) -> None:
+  print("stage".ljust(20), "p50".rjust(8), "p90".rjust(8), "p99".rjust(8), " (ms from end of frame)")
+  for s, hist in chains.histograms.items():
+    print(s.ljust(20), *(f"{hist.percentile(q) or 0:8.0f}" for q in (50, 90, 99)))
+  print("delivery".ljust(20), "p50".rjust(8), "p90".rjust(8), "p99".rjust(8), " (ms from publish to receive)")
+  for s, hist in sorted(chains.delivery_histograms.items()):
+    print(s.ljust(20), *(f"{hist.percentile(q) or 0:8.0f}" for q in (50, 90, 99)))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Live end-to-end latency of openpilot, started with LATENCY_TRACE=1",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--interval", type=float, default=5., help="Seconds between latency histogram summaries")
+  parser.add_argument("--quiet", action="store_true", help="Only print the summaries, not every frame")
+  args = parser.parse_args()
+
+  reader = TraceReader()
+  chains = LatencyChains()
+  last_summary = time.monotonic()
+  while True:
+    for frame_id, latencies in chains.update(reader.read()):
+      if not args.quiet:
+        print(f"frame {frame_id}:", "  ".join(f"{s} {latencies[s]:.1f}" for s in CHAIN))
+
+    if time.monotonic() - last_summary > args.interval:
+      print_summary(chains)
+      last_summary = time.monotonic()
+    time.sleep(0.05)
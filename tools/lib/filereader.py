@@ -5,16 +5,19 @@ from urllib.parse import urlparse
 from openpilot.tools.lib.url_file import URLFile
 
 DATA_ENDPOINT = os.getenv("DATA_ENDPOINT", "http://data-raw.comma.internal/")
+# an unreachable host otherwise takes minutes to give up on
+INTERNAL_SOURCE_TIMEOUT = 2.
 
 
-def internal_source_available(url=DATA_ENDPOINT):
+def internal_source_available(url=DATA_ENDPOINT, timeout=INTERNAL_SOURCE_TIMEOUT):
   try:
     hostname = urlparse(url).hostname
     port = urlparse(url).port or 80
     with socket.socket(socket.AF_INET,socket.SOCK_STREAM) as s:
+      s.settimeout(timeout)
       s.connect((hostname, port))
     return True
-  except (socket.gaierror, ConnectionRefusedError):
+  except (socket.gaierror, ConnectionRefusedError, TimeoutError):
     pass
   return False
 
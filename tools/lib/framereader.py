@@ -4,16 +4,19 @@ import pickle
 import struct
 import subprocess
 import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import IntEnum
+from fractions import Fraction
 from functools import wraps
 
+import av
 import numpy as np
-from lru import LRU
 
 import _io
 from openpilot.tools.lib.cache import cache_path_for_file_path, DEFAULT_CACHE_DIR
 from openpilot.tools.lib.exceptions import DataUnreadableError
-from openpilot.tools.lib.vidindex import hevc_index
+from openpilot.tools.lib.vidindex import VideoFileInvalid, hevc_dimensions, hevc_index
 from openpilot.common.file_helpers import atomic_write_in_dir
 
 from openpilot.tools.lib.filereader import FileReader, resolve_name
@@ -22,19 +25,23 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# bump when the value of a cache_fn function changes, older cache files are recomputed
+CACHE_FN_VERSION = 2
+
+# decoded frames kept by each reader, by default FRAME_CACHE_FRAMES frames of the largest format of the stream read
+FRAME_CACHE_FRAMES = 64
+FRAME_CACHE_BYTES: int | None = int(os.getenv("FRAMEREADER_CACHE_BYTES", "0")) or None
+# GOPs decoded in parallel, shared by all readers in the process
+DECODE_THREADS = int(os.getenv("FRAMEREADER_DECODE_THREADS", str(max((os.cpu_count() or 1) // 2, 1))))
+
 
 class GOPReader:
   def get_gop(self, num):
     # returns (start_frame_num, num_frames, frames_to_skip, gop_data)
     raise NotImplementedError
 
-
-class DoNothingContextManager:
-  def __enter__(self):
-    return self
-
-  def __exit__(self, *x):
-    pass
+  def get_gop_start(self, num):
+    return self.get_gop(num)[0]
 
 
 class FrameType(IntEnum):
@@ -84,13 +91,19 @@ def cache_fn(func):
       cache_path = cache_path_for_file_path(fn, cache_dir)
 
     if cache_path and os.path.exists(cache_path):
-      with open(cache_path, "rb") as cache_file:
-        cache_value = pickle.load(cache_file)
-    else:
-      cache_value = func(fn, *args, **kwargs)
-      if cache_path:
-        with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
-          pickle.dump(cache_value, cache_file, -1)
+      try:
+        with open(cache_path, "rb") as cache_file:
+          version, cache_value = pickle.load(cache_file)
+        if version == CACHE_FN_VERSION:
+          return cache_value
+      except (pickle.UnpicklingError, EOFError, TypeError, ValueError):
+        # unversioned or unreadable, written by an older version
+        pass
+
+    cache_value = func(fn, *args, **kwargs)
+    if cache_path:
+      with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
+        pickle.dump((CACHE_FN_VERSION, cache_value), cache_file, -1)
 
     return cache_value
 
@@ -104,7 +117,16 @@ def index_stream(fn, ft):
 
   frame_types, dat_len, prefix = hevc_index(fn)
   index = np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32)
-  probe = ffprobe(fn, "hevc")
+
+  # the SPS has the dimensions, so ffprobe is only needed without a readable one
+  try:
+    dimensions = hevc_dimensions(prefix)
+  except VideoFileInvalid:
+    dimensions = None
+  if dimensions is not None:
+    probe = {'streams': [{'width': dimensions[0], 'height': dimensions[1]}]}
+  else:
+    probe = ffprobe(fn, "hevc")
 
   return {
     'index': index,
@@ -123,47 +145,72 @@ def read_file_check_size(f, sz, cookie):
   return buff
 
 
-def rgb24toyuv(rgb):
-  yuv_from_rgb = np.array([[ 0.299     ,  0.587     ,  0.114      ],
-                           [-0.14714119, -0.28886916,  0.43601035 ],
-                           [ 0.61497538, -0.51496512, -0.10001026 ]])
-  img = np.dot(rgb.reshape(-1, 3), yuv_from_rgb.T).reshape(rgb.shape)
+YUV_FROM_RGB = np.array([[ 0.299     ,  0.587     ,  0.114      ],
+                         [-0.14714119, -0.28886916,  0.43601035 ],
+                         [ 0.61497538, -0.51496512, -0.10001026 ]], dtype=np.float32)
+
 
+def frame_shape(pix_fmt, w, h):
+  # shape of one decoded frame, as returned by get
+  if pix_fmt == "rgb24":
+    return (h, w, 3)
+  elif pix_fmt in ("nv12", "yuv420p"):
+    return (h*w*3//2,)
+  elif pix_fmt == "yuv444p":
+    return (3, h, w)
+  raise NotImplementedError
 
 
-  ys = img[:, :, 0]
-  us = (img[::2, ::2, 1] + img[1::2, ::2, 1] + img[::2, 1::2, 1] + img[1::2, 1::2, 1]) / 4 + 128
-  vs = (img[::2, ::2, 2] + img[1::2, ::2, 2] + img[::2, 1::2, 2] + img[1::2, 1::2, 2]) / 4 + 128
+def _rgb24toyuv(rgb):
+  # works on one frame or a batch (..., h, w, 3), returns Y and interleaved (..., h/2, w/2, 2) U and V. Chroma is
+  # averaged over 2x2 blocks, the conversion being linear the RGB values are averaged first, so chroma only ever
+  # needs quarter resolution temporaries
+  ys = np.matmul(rgb, YUV_FROM_RGB[0])
 
-  return ys, us, vs
+  rgb_sum = rgb[..., ::2, ::2, :].astype(np.float32)
+  rgb_sum += rgb[..., 1::2, ::2, :]
+  rgb_sum += rgb[..., ::2, 1::2, :]
+  rgb_sum += rgb[..., 1::2, 1::2, :]
+  uvs = np.matmul(rgb_sum, YUV_FROM_RGB[1:].T / 4)
+  uvs += 128
+  return ys, uvs
 
 
-def rgb24toyuv420(rgb):
-  ys, us, vs = rgb24toyuv(rgb)
+def rgb24toyuv(rgb):
+  ys, uvs = _rgb24toyuv(rgb)
+  return ys, uvs[..., 0], uvs[..., 1]
 
-  y_len = rgb.shape[0] * rgb.shape[1]
-  uv_len = y_len // 4
 
-  yuv420 = np.empty(y_len + 2 * uv_len, dtype=rgb.dtype)
-  yuv420[:y_len] = ys.reshape(-1)
-  yuv420[y_len:y_len + uv_len] = us.reshape(-1)
-  yuv420[y_len + uv_len:y_len + 2 * uv_len] = vs.reshape(-1)
+def _yuv420_out(rgb, out):
+  shape = (*rgb.shape[:-3], rgb.shape[-3] * rgb.shape[-2] * 3 // 2)
+  if out is None:
+    return np.empty(shape, dtype=np.uint8)
+  assert out.shape == shape and out.dtype == np.uint8, (out.shape, out.dtype)
+  return out
 
-  return yuv420.clip(0, 255).astype('uint8')
 
+def rgb24toyuv420(rgb, out=None):
+  ys, uvs = _rgb24toyuv(rgb)
+  out = _yuv420_out(rgb, out)
 
-def rgb24tonv12(rgb):
-  ys, us, vs = rgb24toyuv(rgb)
+  batch, (h, w) = rgb.shape[:-3], rgb.shape[-3:-1]
+  y_len = h * w
+  # splitting the last axis always gives a view, so the planes are written straight into out
+  out[..., :y_len].reshape(*batch, h, w)[...] = ys.clip(0, 255, out=ys)
+  out[..., y_len:].reshape(*batch, 2, h // 2, w // 2)[...] = np.moveaxis(uvs.clip(0, 255, out=uvs), -1, -3)
+  return out
 
-  y_len = rgb.shape[0] * rgb.shape[1]
-  uv_len = y_len // 4
 
-  nv12 = np.empty(y_len + 2 * uv_len, dtype=rgb.dtype)
-  nv12[:y_len] = ys.reshape(-1)
-  nv12[y_len::2] = us.reshape(-1)
-  nv12[y_len+1::2] = vs.reshape(-1)
+def rgb24tonv12(rgb, out=None):
+  ys, uvs = _rgb24toyuv(rgb)
+  out = _yuv420_out(rgb, out)
 
-  return nv12.clip(0, 255).astype('uint8')
+  batch, (h, w) = rgb.shape[:-3], rgb.shape[-3:-1]
+  y_len = h * w
+  out[..., :y_len].reshape(*batch, h, w)[...] = ys.clip(0, 255, out=ys)
+  # U and V are already interleaved
+  out[..., y_len:].reshape(*batch, h // 2, w // 2, 2)[...] = uvs.clip(0, 255, out=uvs)
+  return out
 
 
 def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
@@ -197,6 +244,104 @@ def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
   return ret
 
 
+def _frame_planes(pix_fmt, w, h):
+  # (rows, bytes per row) of each plane, in the same layout ffmpeg's rawvideo output uses
+  if pix_fmt == "rgb24":
+    return [(h, w * 3)]
+  elif pix_fmt == "nv12":
+    return [(h, w), (h // 2, w)]
+  elif pix_fmt == "yuv420p":
+    return [(h, w), (h // 2, w // 2), (h // 2, w // 2)]
+  elif pix_fmt == "yuv444p":
+    return [(h, w)] * 3
+  raise NotImplementedError
+
+
+def _av_format_graph(frame, pix_fmt):
+  # the format filter the ffmpeg cli inserts for -pix_fmt, swscale called directly places the chroma differently
+  graph = av.filter.Graph()
+  src = graph.add_buffer(width=frame.width, height=frame.height, format=frame.format.name, time_base=Fraction(1, 1000))
+  fmt = graph.add("format", pix_fmt)
+  src.link_to(fmt)
+  fmt.link_to(graph.add("buffersink"))
+  graph.configure()
+  return graph
+
+
+def decode_video_data_av(rawdat, vid_fmt, w, h, pix_fmt):
+  # decodes in process with libav, the output matches decompress_video_data
+  codec = av.CodecContext.create(vid_fmt, "r")
+  codec.thread_type = "AUTO"
+  codec.thread_count = int(os.getenv("FFMPEG_THREADS", "0"))
+
+  # parsing None flushes the parser's last packet, decoding None the decoder's delayed frames
+  packets = codec.parse(rawdat) + codec.parse(None)
+  frames = [f for packet in packets for f in codec.decode(packet)]
+  frames += codec.decode(None)
+
+  planes = _frame_planes(pix_fmt, w, h)
+  ret = np.empty((len(frames), sum(rows * row_bytes for rows, row_bytes in planes)), dtype=np.uint8)
+  graph = None
+  for i, frame in enumerate(frames):
+    if frame.format.name != pix_fmt:
+      graph = graph or _av_format_graph(frame, pix_fmt)
+      graph.push(frame)
+      frame = graph.pull()
+    offset = 0
+    for plane, (rows, row_bytes) in zip(frame.planes, planes, strict=True):
+      dat = np.frombuffer(plane, dtype=np.uint8).reshape(-1, plane.line_size)
+      ret[i, offset:offset + rows * row_bytes].reshape(rows, row_bytes)[:] = dat[:rows, :row_bytes]
+      offset += rows * row_bytes
+
+  if pix_fmt == "rgb24":
+    return ret.reshape(-1, h, w, 3)
+  elif pix_fmt == "yuv444p":
+    return ret.reshape(-1, 3, h, w)
+  return ret
+
+
+def decode_video_data(rawdat, vid_fmt, w, h, pix_fmt, num_frames=None):
+  # decoding in process avoids spawning ffmpeg for every GOP, which is still used for cuda or if libav comes up short
+  if os.getenv("FFMPEG_CUDA", "0") != "1":
+    try:
+      ret = decode_video_data_av(rawdat, vid_fmt, w, h, pix_fmt)
+      if num_frames is None or ret.shape[0] == num_frames:
+        return ret
+    except (av.error.FFmpegError, ValueError):
+      pass
+  return decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt)
+
+
+class FrameCache:
+  """Decoded frames, evicting the least recently used ones once they take up more than max_bytes"""
+
+  def __init__(self, max_bytes: int):
+    self.max_bytes = max_bytes
+    self._frames: OrderedDict[tuple[int, str], np.ndarray] = OrderedDict()
+    self._nbytes = 0
+    self._lock = threading.Lock()
+
+  def __contains__(self, key):
+    return key in self._frames
+
+  def get(self, key):
+    with self._lock:
+      frame = self._frames.get(key)
+      if frame is not None:
+        self._frames.move_to_end(key)
+      return frame
+
+  def put(self, key, frame):
+    with self._lock:
+      old = self._frames.pop(key, None)
+      if old is not None:
+        self._nbytes -= old.nbytes
+      self._frames[key] = frame
+      self._nbytes += frame.nbytes
+      while self._nbytes > self.max_bytes and len(self._frames) > 1:
+        self._nbytes -= self._frames.popitem(last=False)[1].nbytes
+
+
 class BaseFrameReader:
   # properties: frame_type, frame_count, w, h
 
@@ -212,15 +357,26 @@ class BaseFrameReader:
   def get(self, num, count=1, pix_fmt="yuv420p"):
     raise NotImplementedError
 
+  def get_batch(self, num, count=1, pix_fmt="yuv420p", out=None):
+    """Same frames as get, in one contiguous (count, *frame_shape) array. Written into out if given"""
+    shape = (count, *frame_shape(pix_fmt, self.w, self.h))
+    if out is None:
+      out = np.empty(shape, dtype=np.uint8)
+    assert out.shape == shape and out.dtype == np.uint8, (out.shape, out.dtype)
+
+    for i, frame in enumerate(self.get(num, count, pix_fmt)):
+      out[i] = frame
+    return out
 
-def FrameReader(fn, cache_dir=DEFAULT_CACHE_DIR, readahead=False, readbehind=False, index_data=None):
+
+def FrameReader(fn, cache_dir=DEFAULT_CACHE_DIR, readahead=False, readbehind=False, index_data=None, cache_bytes=FRAME_CACHE_BYTES):
   frame_type = fingerprint_video(fn)
   if frame_type == FrameType.raw:
     return RawFrameReader(fn)
   elif frame_type in (FrameType.h265_stream,):
     if not index_data:
       index_data = get_video_index(fn, frame_type, cache_dir)
-    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind)
+    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind, cache_bytes=cache_bytes)
   else:
     raise NotImplementedError(frame_type)
 
@@ -251,26 +407,34 @@ class RawFrameReader(BaseFrameReader):
     return cimg
 
   def get(self, num, count=1, pix_fmt="yuv420p"):
+    return list(self.get_batch(num, count, pix_fmt))
+
+  def get_batch(self, num, count=1, pix_fmt="yuv420p", out=None):
     assert self.frame_count is not None
     assert num+count <= self.frame_count
 
     if pix_fmt not in ("nv12", "yuv420p", "rgb24"):
       raise ValueError(f"Unsupported pixel format {pix_fmt!r}")
 
-    app = []
-    for i in range(num, num+count):
-      dat = self.rawfile.read(i)
+    shape = (count, *frame_shape(pix_fmt, self.w, self.h))
+    if out is None:
+      out = np.empty(shape, dtype=np.uint8)
+    assert out.shape == shape and out.dtype == np.uint8, (out.shape, out.dtype)
+
+    # converted straight into out, one frame at a time
+    for i in range(count):
+      dat = self.rawfile.read(num + i)
       rgb_dat = self.load_and_debayer(dat)
       if pix_fmt == "rgb24":
-        app.append(rgb_dat)
+        out[i] = rgb_dat
       elif pix_fmt == "nv12":
-        app.append(rgb24tonv12(rgb_dat))
+        rgb24tonv12(rgb_dat, out=out[i])
       elif pix_fmt == "yuv420p":
-        app.append(rgb24toyuv420(rgb_dat))
+        rgb24toyuv420(rgb_dat, out=out[i])
       else:
         raise NotImplementedError
 
-    return app
+    return out
 
 
 class VideoStreamDecompressor:
@@ -386,6 +550,9 @@ class StreamGOPReader(GOPReader):
     self.w = probe['streams'][0]['width']
     self.h = probe['streams'][0]['height']
 
+  def get_gop_start(self, num):
+    return self._lookup_gop(num)[0]
+
   def _lookup_gop(self, num):
     frame_b = num
     while frame_b > 0 and self.index[frame_b, 0] != HEVC_SLICE_I:
@@ -422,80 +589,105 @@ class StreamGOPReader(GOPReader):
 
     return frame_b, num_frames, skip_frames, rawdat
 
+  def get_frame_data(self, num):
+    # only what decoding frame num needs: from the start of its GOP up to and including it
+    frame_b, _, offset_b, _ = self._lookup_gop(num)
+    offset_e = self.index[num + 1, 1]
+
+    with FileReader(self.fn) as f:
+      f.seek(offset_b)
+      rawdat = f.read(offset_e - offset_b)
+
+    return frame_b, self.prefix + rawdat
 
-class GOPFrameReader(BaseFrameReader):
+
+class GOPFrameReader(BaseFrameReader, GOPReader):
   #FrameReader with caching and readahead for formats that are group-of-picture based
+  _executor: ThreadPoolExecutor | None = None
+
+  @staticmethod
+  def executor() -> ThreadPoolExecutor:
+    # decoding releases the GIL, so GOPs are decoded in parallel on threads
+    if GOPFrameReader._executor is None:
+      GOPFrameReader._executor = ThreadPoolExecutor(max_workers=DECODE_THREADS)
+    return GOPFrameReader._executor
 
-  def __init__(self, readahead=False, readbehind=False):
+  def __init__(self, readahead=False, readbehind=False, cache_bytes=FRAME_CACHE_BYTES):
     self.open_ = True
 
     self.readahead = readahead
     self.readbehind = readbehind
-    self.frame_cache = LRU(64)
+    self.readahead_len = 30
+    if cache_bytes is None:
+      cache_bytes = FRAME_CACHE_FRAMES * int(np.prod(frame_shape("rgb24", self.w, self.h)))
+    self.frame_cache = FrameCache(cache_bytes)
 
-    if self.readahead:
-      self.cache_lock = threading.RLock()
-      self.readahead_last = None
-      self.readahead_len = 30
-      self.readahead_c = threading.Condition()
-      self.readahead_thread = threading.Thread(target=self._readahead_thread)
-      self.readahead_thread.daemon = True
-      self.readahead_thread.start()
-    else:
-      self.cache_lock = DoNothingContextManager()
+    # GOPs being decoded, by (first frame, pix_fmt)
+    self._decoding: dict[tuple[int, str], Future] = {}
+    self._decoding_lock = threading.Lock()
 
   def close(self):
     if not self.open_:
       return
     self.open_ = False
 
-    if self.readahead:
-      self.readahead_c.acquire()
-      self.readahead_c.notify()
-      self.readahead_c.release()
-      self.readahead_thread.join()
-
-  def _readahead_thread(self):
-    while True:
-      self.readahead_c.acquire()
-      try:
-        if not self.open_:
-          break
-        self.readahead_c.wait()
-      finally:
-        self.readahead_c.release()
-      if not self.open_:
-        break
-      assert self.readahead_last
-      num, pix_fmt = self.readahead_last
-
-      if self.readbehind:
-        for k in range(num - 1, max(0, num - self.readahead_len), -1):
-          self._get_one(k, pix_fmt)
-      else:
-        for k in range(num, min(self.frame_count, num + self.readahead_len)):
-          self._get_one(k, pix_fmt)
-
-  def _get_one(self, num, pix_fmt):
+    with self._decoding_lock:
+      futures = list(self._decoding.values())
+    # cancelling runs the done callbacks, which take the lock
+    for future in futures:
+      future.cancel()
+
+  def _decode_gop(self, num, pix_fmt):
+    frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+
+    ret = decode_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt, num_frames=skip_frames + num_frames)
+    ret = ret[skip_frames:]
+    assert ret.shape[0] == num_frames
+
+    for i in range(ret.shape[0]):
+      self.frame_cache.put((frame_b+i, pix_fmt), ret[i])
+    return frame_b, ret
+
+  def _submit_gop(self, num, pix_fmt) -> Future | None:
+    """Start decoding the GOP holding frame num, unless it is already being decoded"""
+    key = (self.get_gop_start(num), pix_fmt)
+    with self._decoding_lock:
+      future = self._decoding.get(key)
+      if future is not None:
+        return future
+      future = self.executor().submit(self._decode_gop, num, pix_fmt)
+      self._decoding[key] = future
+    # called right away if it is already done, so not while holding the lock
+    future.add_done_callback(lambda f: self._gop_done(key, f))
+    return future
+
+  def _gop_done(self, key, future):
+    with self._decoding_lock:
+      if self._decoding.get(key) is future:
+        del self._decoding[key]
+
+  def _get_one(self, num, pix_fmt, future=None):
     assert num < self.frame_count
 
-    if (num, pix_fmt) in self.frame_cache:
-      return self.frame_cache[(num, pix_fmt)]
-
-    with self.cache_lock:
-      if (num, pix_fmt) in self.frame_cache:
-        return self.frame_cache[(num, pix_fmt)]
+    frame = self.frame_cache.get((num, pix_fmt))
+    if frame is not None:
+      return frame
 
-      frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+    if future is None:
+      future = self._submit_gop(num, pix_fmt)
+    # from the decoded GOP, the cache might not hold it anymore
+    frame_b, frames = future.result()
+    return frames[num - frame_b]
 
-      ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
-      ret = ret[skip_frames:]
-      assert ret.shape[0] == num_frames
-
-      for i in range(ret.shape[0]):
-        self.frame_cache[(frame_b+i, pix_fmt)] = ret[i]
+  def _read_ahead(self, num, pix_fmt):
+    if self.readbehind:
+      frames = range(num - 1, max(0, num - self.readahead_len), -1)
+    else:
+      frames = range(num, min(self.frame_count, num + self.readahead_len))
 
-      return self.frame_cache[(num, pix_fmt)]
+    for k in frames:
+      if (k, pix_fmt) not in self.frame_cache:
+        self._submit_gop(k, pix_fmt)
 
   def get(self, num, count=1, pix_fmt="yuv420p"):
     assert self.frame_count is not None
@@ -506,21 +698,24 @@ class GOPFrameReader(BaseFrameReader):
     if pix_fmt not in ("nv12", "yuv420p", "rgb24", "yuv444p"):
       raise ValueError(f"Unsupported pixel format {pix_fmt!r}")
 
-    ret = [self._get_one(num + i, pix_fmt) for i in range(count)]
+    # every missing GOP is decoded in parallel before waiting on any of them
+    futures = {}
+    for i in range(num, num + count):
+      if (i, pix_fmt) not in self.frame_cache:
+        futures[i] = self._submit_gop(i, pix_fmt)
+
+    ret = [self._get_one(i, pix_fmt, futures.get(i)) for i in range(num, num + count)]
 
     if self.readahead:
-      self.readahead_last = (num+count, pix_fmt)
-      self.readahead_c.acquire()
-      self.readahead_c.notify()
-      self.readahead_c.release()
+      self._read_ahead(num + count, pix_fmt)
 
     return ret
 
 
 class StreamFrameReader(StreamGOPReader, GOPFrameReader):
-  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False):
+  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False, cache_bytes=FRAME_CACHE_BYTES):
     StreamGOPReader.__init__(self, fn, frame_type, index_data)
-    GOPFrameReader.__init__(self, readahead, readbehind)
+    GOPFrameReader.__init__(self, readahead, readbehind, cache_bytes)
 
 
 def GOPFrameIterator(gop_reader, pix_fmt):
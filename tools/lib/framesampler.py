@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import argparse
+import multiprocessing
+import os
+from collections import deque
+from collections.abc import Iterator
+
+import numpy as np
+
+from openpilot.system.loggerd.config import CAMERA_FPS, SEGMENT_LENGTH
+from openpilot.tools.lib.framereader import HEVC_SLICE_I, FrameType, StreamGOPReader, decode_video_data, get_video_index
+from openpilot.tools.lib.route import Route
+
+CAMERA_PATHS = {
+  "fcamera": Route.camera_paths,
+  "ecamera": Route.ecamera_paths,
+  "dcamera": Route.dcamera_paths,
+}
+
+SampledFrame = tuple[int, int, float, np.ndarray]
+
+
+def sample_frame_ids(index: np.ndarray, fps: float, keyframes_only=False) -> list[list[int]]:
+  """Frames of a segment to sample at fps, grouped by GOP"""
+  frame_count = len(index) - 1
+  frame_ids = np.unique(np.round(np.arange(0, frame_count, CAMERA_FPS / fps)).astype(int))
+  frame_ids = frame_ids[frame_ids < frame_count]
+
+  iframes = np.flatnonzero(index[:-1, 0] == HEVC_SLICE_I)
+  gops = iframes[np.searchsorted(iframes, frame_ids, side='right') - 1]
+  if keyframes_only:
+    return [[int(gop)] for gop in np.unique(gops)]
+  return [group.tolist() for group in np.split(frame_ids, np.flatnonzero(np.diff(gops)) + 1)]
+
+
+def _index_segment(path: str) -> dict:
+  index_data: dict = get_video_index(path, FrameType.h265_stream)
+  return index_data
+
+
+def _decode_frames(path: str, index_data: dict, frame_ids: list[int], pix_fmt: str) -> list[np.ndarray]:
+  # decodes the GOP only as far as the last wanted frame
+  reader = StreamGOPReader(path, FrameType.h265_stream, index_data)
+  frame_b, rawdat = reader.get_frame_data(frame_ids[-1])
+  frames = decode_video_data(rawdat, reader.vid_fmt, reader.w, reader.h, pix_fmt, num_frames=frame_ids[-1] - frame_b + 1)
+  return [np.ascontiguousarray(frames[i - frame_b]) for i in frame_ids]
+
+
+def sample_route_frames(route: str | Route, fps: float = 1., camera: str = "fcamera", pix_fmt: str = "rgb24",
+                        keyframes_only=False, num_processes: int | None = None, data_dir: str | None = None) -> Iterator[SampledFrame]:
+  """
+  Yield (segment, frame_id, timestamp, image) for frames sampled across a route at fps, in order. Segments are decoded
+  in parallel across processes, each GOP only as far as its last sampled frame. With keyframes_only, the I-frame
+  starting each GOP is used instead of the frame at the exact sampling time, so nothing else is ever decoded.
+  Timestamps are nominal seconds since the start of the route.
+  """
+  if camera not in CAMERA_PATHS:
+    raise ValueError(f"Unsupported camera {camera!r}, only hevc cameras {list(CAMERA_PATHS)} can be sampled")
+  if not isinstance(route, Route):
+    route = Route(route, data_dir=data_dir)
+
+  num_processes = num_processes or os.cpu_count() or 1
+  segments = [(seg, path) for seg, path in enumerate(CAMERA_PATHS[camera](route)) if path is not None]
+
+  with multiprocessing.Pool(num_processes) as pool:
+    # segments are indexed a few ahead of the one being decoded, so the first frames come out without waiting on the
+    # whole route's indexes
+    indexes: deque = deque(pool.apply_async(_index_segment, (path,)) for _, path in segments[:num_processes])
+
+    # bounded number of GOPs in flight, so decoded frames don't pile up faster than they are consumed
+    pending: deque = deque()
+    for i, (seg, path) in enumerate(segments):
+      index_data = indexes.popleft().get()
+      if i + num_processes < len(segments):
+        indexes.append(pool.apply_async(_index_segment, (segments[i + num_processes][1],)))
+
+      for frame_ids in sample_frame_ids(index_data['index'], fps, keyframes_only):
+        pending.append((seg, frame_ids, pool.apply_async(_decode_frames, (path, index_data, frame_ids, pix_fmt))))
+        if len(pending) > 2 * num_processes:
+          yield from _sampled_frames(*pending.popleft())
+
+    while len(pending):
+      yield from _sampled_frames(*pending.popleft())
+
+
+def _sampled_frames(seg: int, frame_ids: list[int], result) -> Iterator[SampledFrame]:
+  for frame_id, image in zip(frame_ids, result.get(), strict=True):
+    yield seg, frame_id, seg * SEGMENT_LENGTH + frame_id / CAMERA_FPS, image
+
+
+def main() -> None:
+  from PIL import Image
+
+  parser = argparse.ArgumentParser(description="Save frames sampled across a route as jpegs")
+  parser.add_argument("route", type=str)
+  parser.add_argument("output_dir", type=str)
+  parser.add_argument("--fps", type=float, default=1.)
+  parser.add_argument("--camera", choices=list(CAMERA_PATHS), default="fcamera")
+  parser.add_argument("--keyframes-only", action="store_true")
+  parser.add_argument("--data-dir", type=str, default=None)
+  args = parser.parse_args()
+
+  os.makedirs(args.output_dir, exist_ok=True)
+  for seg, frame_id, _, image in sample_route_frames(args.route, args.fps, args.camera, keyframes_only=args.keyframes_only,
+                                                     data_dir=args.data_dir):
+    Image.fromarray(image).save(os.path.join(args.output_dir, f"{seg:03d}_{frame_id:04d}.jpg"))
+
+
+if __name__ == "__main__":
+  main()
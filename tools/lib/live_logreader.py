@@ -1,8 +1,13 @@
+#!/usr/bin/env python3
+import argparse
 import os
+import time
 from cereal import log as capnp_log, messaging
 from cereal.services import SERVICE_LIST
 
+from openpilot.system.loggerd.config import SEGMENT_LENGTH
 from openpilot.tools.lib.logreader import LogIterable, RawLogIterable
+from openpilot.tools.lib.logwriter import LogWriter
 
 
 ALL_SERVICES = list(SERVICE_LIST.keys())
@@ -20,11 +25,44 @@ def raw_live_logreader(services: list[str] = ALL_SERVICES, addr: str = '127.0.0.
   while True:
     polld = poller.poll(100)
     for sock in polld:
-      msg = sock.receive()
-      yield msg
+      # everything queued up, so busy sockets don't fall behind and drop messages
+      yield from messaging.drain_sock_raw(sock)
 
 
 def live_logreader(services: list[str] = ALL_SERVICES, addr: str = '127.0.0.1') -> LogIterable:
   for m in raw_live_logreader(services, addr):
     with capnp_log.Event.from_bytes(m) as evt:
       yield evt
+
+
+def record_live_logs(output_dir: str, services: list[str] = ALL_SERVICES, addr: str = '127.0.0.1',
+                     segment_length: float = SEGMENT_LENGTH) -> None:
+  """
+  Record messages to output_dir without parsing them, in a new rlog_<n>.zst file every segment_length seconds.
+  Messages are already serialized events, so the files can be read with LogReader.
+  """
+  os.makedirs(output_dir, exist_ok=True)
+  segment = 0
+  writer = LogWriter(os.path.join(output_dir, f"rlog_{segment:05d}.zst"))
+  segment_end = time.monotonic() + segment_length
+  try:
+    for dat in raw_live_logreader(services, addr):
+      if time.monotonic() >= segment_end:
+        writer.close()
+        segment += 1
+        writer = LogWriter(os.path.join(output_dir, f"rlog_{segment:05d}.zst"))
+        segment_end = time.monotonic() + segment_length
+      writer.write(dat)
+  finally:
+    writer.close()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Record live messages into rotating zstd compressed logs")
+  parser.add_argument("output_dir", type=str)
+  parser.add_argument("--addr", type=str, default="127.0.0.1")
+  parser.add_argument("--services", type=str, nargs="+", default=ALL_SERVICES)
+  parser.add_argument("--segment-length", type=float, default=SEGMENT_LENGTH)
+  args = parser.parse_args()
+
+  record_live_logs(args.output_dir, args.services, args.addr, args.segment_length)
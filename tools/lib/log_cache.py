@@ -0,0 +1,96 @@
+import enum
+import os
+from collections.abc import Iterable
+
+import zstandard as zstd
+
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.tools.lib.cache import DEFAULT_CACHE_DIR
+from openpilot.tools.lib.filereader import resolve_name
+from openpilot.tools.lib.url_file import URLFile, hash_256
+
+LOG_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "logs")
+# bytes of decompressed logs kept on disk, least recently used ones are evicted past it
+MAX_LOG_CACHE_SIZE = int(os.getenv("LOG_CACHE_SIZE", str(50 * 1024 ** 3)))
+# fast to write, and zstd decompresses at the same speed whatever the level
+LOG_CACHE_ZSTD_LEVEL = 3
+
+
+class LogCacheFormat(enum.StrEnum):
+  ZST = "zst"  # recompressed as zstd, several times faster to read back than bz2
+  RAW = "raw"  # decompressed, can be memory mapped
+
+
+CACHE_EXT = {LogCacheFormat.ZST: ".zst", LogCacheFormat.RAW: ""}
+
+
+def _is_remote(fn: str) -> bool:
+  return fn.startswith(("http://", "https://"))
+
+
+def cached_log_path(fn: str, fmt: LogCacheFormat, ext: str, cache_dir: str = LOG_CACHE_DIR) -> str | None:
+  """
+  Where the log is cached, keyed by its resolved URL (without query string) and its length so a re-uploaded file gets
+  a new entry. None if reading it from the cache would not be any faster than reading it directly.
+  """
+  fn = resolve_name(fn)
+  if _is_remote(fn):
+    length = URLFile(fn).get_length()
+    if length == -1:
+      return None
+  else:
+    if ext in ('', CACHE_EXT[fmt]) or not os.path.isfile(fn):
+      return None
+    fn, length = os.path.abspath(fn), os.path.getsize(fn)
+  return os.path.join(cache_dir, f"{hash_256(fn)}_{length}{CACHE_EXT[fmt]}")
+
+
+def store_log(path: str, chunks: Iterable[bytes], fmt: LogCacheFormat) -> None:
+  """Write a decompressed log, given in chunks, to its cache path"""
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+    if fmt == LogCacheFormat.ZST:
+      compressor = zstd.ZstdCompressor(level=LOG_CACHE_ZSTD_LEVEL, threads=-1).compressobj()
+      for chunk in chunks:
+        f.write(compressor.compress(chunk))
+      f.write(compressor.flush())
+    else:
+      for chunk in chunks:
+        f.write(chunk)
+  evict_log_cache(os.path.dirname(path), keep=path)
+
+
+def touch_log(path: str) -> bool:
+  """Mark a cached log as used, False if it isn't cached"""
+  try:
+    os.utime(path)
+    return True
+  except FileNotFoundError:
+    return False
+
+
+def evict_log_cache(cache_dir: str = LOG_CACHE_DIR, max_size: int = MAX_LOG_CACHE_SIZE, keep: str | None = None) -> None:
+  """Delete the least recently used logs, other than keep, until the cache takes up at most max_size bytes"""
+  entries = []
+  total_size = 0
+  for fn in os.listdir(cache_dir):
+    path = os.path.join(cache_dir, fn)
+    try:
+      st = os.stat(path)
+    except FileNotFoundError:
+      continue
+    entries.append((st.st_mtime, path, st.st_size))
+    total_size += st.st_size
+
+  for _, path, size in sorted(entries):
+    if total_size <= max_size:
+      break
+    if path == keep:
+      # just stored, about to be read
+      continue
+    try:
+      # readers that already opened or mapped it keep their copy until they are done
+      os.unlink(path)
+    except FileNotFoundError:
+      pass
+    total_size -= size
@@ -0,0 +1,95 @@
+import struct
+from collections.abc import Iterable, Iterator
+
+from cereal import log as capnp_log
+
+# Every event in a log is a standalone capnp message in the stream framing:
+#   (segment count - 1) as uint32, one uint32 size (in words) per segment,
+#   padding to the next word boundary, then the segments themselves.
+# https://capnproto.org/encoding.html#serialization-over-a-stream
+WORD_SIZE = 8
+MAX_SEGMENTS = 512  # same limit capnp applies when reading
+
+# layout of the Event root struct, used to peek at events without decoding them
+_EVENT_STRUCT = capnp_log.Event.schema.node.struct
+LOG_MONO_TIME_OFFSET = next(f.slot.offset for f in _EVENT_STRUCT.fields if f.name == "logMonoTime") * 8
+DISCRIMINANT_OFFSET = _EVENT_STRUCT.discriminantOffset * 2
+NO_DISCRIMINANT = 0xFFFF
+EVENT_TYPES: dict[int, str] = {f.discriminantValue: f.name for f in _EVENT_STRUCT.fields if f.discriminantValue != NO_DISCRIMINANT}
+
+
+class FramingError(Exception):
+  pass
+
+
+def _header_size(dat, offset: int) -> int:
+  num_segments: int = struct.unpack_from("<I", dat, offset)[0] + 1
+  return (4 + 4 * num_segments + WORD_SIZE - 1) & ~(WORD_SIZE - 1)
+
+
+def event_size(dat, offset: int = 0) -> int | None:
+  """Size in bytes of the event starting at offset, or None if dat ends before its header does"""
+  if len(dat) - offset < 4:
+    return None
+
+  num_segments: int = struct.unpack_from("<I", dat, offset)[0] + 1
+  if num_segments > MAX_SEGMENTS:
+    raise FramingError(f"invalid segment count {num_segments} @ {offset}")
+
+  header_size = _header_size(dat, offset)
+  if len(dat) - offset < header_size:
+    return None
+  segment_sizes: tuple[int, ...] = struct.unpack_from(f"<{num_segments}I", dat, offset + 4)
+  return header_size + WORD_SIZE * sum(segment_sizes)
+
+
+def event_header(dat, offset: int = 0) -> tuple[int, int]:
+  """logMonoTime and union discriminant of a complete event, read from its root pointer without decoding it"""
+  segment_start = offset + _header_size(dat, offset)
+  pointer = struct.unpack_from("<Q", dat, segment_start)[0]
+  if pointer & 3 != 0:
+    # far pointer, root struct lives in another segment
+    raise FramingError(f"root of event @ {offset} is not a struct pointer")
+
+  struct_offset = (pointer & 0xFFFFFFFF) >> 2
+  if struct_offset >= 1 << 29:
+    struct_offset -= 1 << 30
+  data_start = segment_start + WORD_SIZE * (1 + struct_offset)
+  data_size = WORD_SIZE * ((pointer >> 32) & 0xFFFF)
+
+  # fields past the end of the data section are zero, as written by an older schema
+  log_mono_time = struct.unpack_from("<Q", dat, data_start + LOG_MONO_TIME_OFFSET)[0] if LOG_MONO_TIME_OFFSET + 8 <= data_size else 0
+  which = struct.unpack_from("<H", dat, data_start + DISCRIMINANT_OFFSET)[0] if DISCRIMINANT_OFFSET + 2 <= data_size else 0
+  return log_mono_time, which
+
+
+def event_type(dat, offset: int = 0) -> str | None:
+  """Union type of a complete event (same as which()), or None if unknown to this schema"""
+  return EVENT_TYPES.get(event_header(dat, offset)[1])
+
+
+def iter_events(dat) -> Iterator[tuple[int, int]]:
+  """Offset and size of each event in a buffer holding a whole log"""
+  offset = 0
+  while offset < len(dat):
+    size = event_size(dat, offset)
+    if size is None or offset + size > len(dat):
+      raise FramingError(f"log ends with {len(dat) - offset} bytes of an incomplete event")
+    yield offset, size
+    offset += size
+
+
+def split_events(chunks: Iterable[bytes]) -> Iterator[bytes]:
+  """Reassemble arbitrarily sized chunks of a log into one bytes object per event"""
+  buf = bytearray()
+  for chunk in chunks:
+    buf += chunk
+    offset = 0
+    with memoryview(buf) as view:
+      while (size := event_size(view, offset)) is not None and offset + size <= len(view):
+        yield bytes(view[offset:offset + size])
+        offset += size
+    del buf[:offset]
+
+  if len(buf):
+    raise FramingError(f"log ends with {len(buf)} bytes of an incomplete event")
@@ -0,0 +1,139 @@
+import os
+from collections.abc import Iterable
+
+import capnp
+import numpy as np
+
+from cereal import log as capnp_log
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.tools.lib.cache import cache_path_for_file_path, DEFAULT_CACHE_DIR
+from openpilot.tools.lib.filereader import resolve_name
+from openpilot.tools.lib.log_framing import EVENT_TYPES, NO_DISCRIMINANT, FramingError, event_header
+from openpilot.tools.lib.url_file import URLFile
+
+# bump when the on-disk layout changes, older index files are rebuilt
+LOG_INDEX_VERSION = 2
+EVENT_TYPE_IDS = {name: which for which, name in EVENT_TYPES.items()}
+
+TimeRange = tuple[int | None, int | None]
+# size and modification time (0 for remote files) of the file an index was built from
+FileSignature = tuple[int, int]
+
+
+class StaleLogIndexError(Exception):
+  pass
+
+
+def file_signature(fn: str) -> FileSignature | None:
+  """What identifies this version of a log file, None if it can't be told apart from a rewritten one"""
+  fn = resolve_name(fn)
+  if fn.startswith(("http://", "https://")):
+    length = URLFile(fn).get_length()
+    return (length, 0) if length != -1 else None
+  try:
+    st = os.stat(fn)
+  except OSError:
+    return None
+  return st.st_size, st.st_mtime_ns
+
+
+def read_event_header(dat) -> tuple[int, int]:
+  """Same as event_header, decoding the event when its root struct can't be located directly"""
+  try:
+    return event_header(dat)
+  except FramingError:
+    with capnp_log.Event.from_bytes(dat) as ent:
+      try:
+        return ent.logMonoTime, EVENT_TYPE_IDS[ent.which()]
+      except capnp.KjException:
+        return ent.logMonoTime, NO_DISCRIMINANT
+
+
+def in_time_range(mono_time: int, time_range: TimeRange) -> bool:
+  start, end = time_range
+  return (start is None or mono_time >= start) and (end is None or mono_time < end)
+
+
+class LogIndexBuilder:
+  def __init__(self):
+    self.offsets: list[int] = []
+    self.sizes: list[int] = []
+    self.mono_times: list[int] = []
+    self.types: list[int] = []
+    self.data_len = 0
+
+  def add(self, dat) -> None:
+    """Record the next event of the log, given its raw bytes"""
+    mono_time, which = read_event_header(dat)
+    self.offsets.append(self.data_len)
+    self.sizes.append(len(dat))
+    self.mono_times.append(mono_time)
+    self.types.append(which)
+    self.data_len += len(dat)
+
+  def finish(self, signature: FileSignature) -> 'LogIndex':
+    return LogIndex(np.array(self.offsets, dtype=np.uint64), np.array(self.sizes, dtype=np.uint32),
+                    np.array(self.mono_times, dtype=np.uint64), np.array(self.types, dtype=np.uint16), self.data_len, signature)
+
+
+class LogIndex:
+  """Offset (into the decompressed log), size, logMonoTime and union type of every event in a log file, stored as columns"""
+
+  def __init__(self, offsets: np.ndarray, sizes: np.ndarray, mono_times: np.ndarray, types: np.ndarray, data_len: int,
+               signature: FileSignature):
+    self.offsets = offsets
+    self.sizes = sizes
+    self.mono_times = mono_times
+    self.types = types
+    self.data_len = data_len
+    self.signature = signature
+
+  def __len__(self) -> int:
+    return len(self.offsets)
+
+  def select(self, services: Iterable[str] | None = None, time_range: TimeRange | None = None) -> np.ndarray:
+    """Positions of the events of the given services within [start, end) logMonoTime"""
+    mask = np.ones(len(self), dtype=bool)
+    if services is not None:
+      mask &= np.isin(self.types, [EVENT_TYPE_IDS[s] for s in services if s in EVENT_TYPE_IDS])
+    if time_range is not None:
+      start, end = time_range
+      if start is not None:
+        mask &= self.mono_times >= start
+      if end is not None:
+        mask &= self.mono_times < end
+    return np.flatnonzero(mask)
+
+  def save(self, path: str) -> None:
+    with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+      np.savez(f, version=LOG_INDEX_VERSION, data_len=self.data_len, signature=np.array(self.signature, dtype=np.int64),
+               offsets=self.offsets, sizes=self.sizes, mono_times=self.mono_times, types=self.types)
+
+  @staticmethod
+  def load(path: str) -> 'LogIndex | None':
+    try:
+      with np.load(path) as f:
+        if int(f['version']) != LOG_INDEX_VERSION:
+          return None
+        signature = f['signature'].tolist()
+        return LogIndex(f['offsets'], f['sizes'], f['mono_times'], f['types'], int(f['data_len']), (signature[0], signature[1]))
+    except (OSError, KeyError, ValueError):
+      return None
+
+
+def log_index_path(fn: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+  return str(cache_path_for_file_path(fn, cache_dir)) + ".logindex.npz"
+
+
+def load_log_index(fn: str, signature: FileSignature, cache_dir: str = DEFAULT_CACHE_DIR) -> LogIndex | None:
+  """Index of fn, None if there is none or it was built from another version of the file"""
+  path = log_index_path(fn, cache_dir)
+  index = LogIndex.load(path) if os.path.exists(path) else None
+  return index if index is not None and index.signature == signature else None
+
+
+def remove_log_index(fn: str, cache_dir: str = DEFAULT_CACHE_DIR) -> None:
+  try:
+    os.unlink(log_index_path(fn, cache_dir))
+  except FileNotFoundError:
+    pass
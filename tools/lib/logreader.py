@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
 import bz2
-from functools import cache, partial
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed, wait
+from functools import partial
+import itertools
+import mmap
 import multiprocessing
 import capnp
 import enum
+import numpy as np
+import operator
 import os
 import pathlib
+import queue
 import sys
+import threading
+import time
 import tqdm
 import urllib.parse
 import warnings
@@ -20,60 +29,306 @@ from openpilot.common.swaglog import cloudlog
 from openpilot.tools.lib.comma_car_segments import get_url as get_comma_segments_url
 from openpilot.tools.lib.openpilotci import get_url
 from openpilot.tools.lib.filereader import FileReader, file_exists, internal_source_available
+from openpilot.tools.lib.log_cache import CACHE_EXT, LogCacheFormat, cached_log_path, store_log, touch_log
+from openpilot.tools.lib.log_framing import EVENT_TYPES, FramingError, iter_events, split_events
+from openpilot.tools.lib.log_index import LogIndex, LogIndexBuilder, StaleLogIndexError, TimeRange, file_signature, in_time_range, \
+                                           load_log_index, log_index_path, read_event_header, remove_log_index
+from openpilot.tools.lib.logwriter import LogWriter
 from openpilot.tools.lib.route import Route, SegmentRange
 
 LogMessage = type[capnp._DynamicStructReader]
 LogIterable = Iterable[LogMessage]
 RawLogIterable = Iterable[bytes]
 
+STREAM_CHUNK_SIZE = 1024 * 1024
+ZSTD_MAGIC = b'\x28\xB5\x2F\xFD'  # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
 
-def save_log(dest, log_msgs, compress=True):
-  dat = b"".join(msg.as_builder().to_bytes() for msg in log_msgs)
+# concurrent existence checks (HEAD requests for remote files) when looking for a route's logs
+MAX_PROBE_WORKERS = 16
+# a less preferred source is only checked once the ones before it failed, or took longer than this
+SOURCE_START_DELAY = 2.
+# files found missing are checked again after this long, they might have been uploaded since
+MISSING_FILE_TTL = 60.
+MAX_PROBE_CACHE_SIZE = 4096
 
-  if compress and dest.endswith(".bz2"):
-    dat = bz2.compress(dat)
-  elif compress and dest.endswith(".zst"):
-    dat = zstd.compress(dat, 10)
 
-  with open(dest, "wb") as f:
-    f.write(dat)
+def save_log(dest, log_msgs, compress=True):
+  # log_msgs are serialized again, see LogWriter for writing the raw bytes of events from iter_raw instead
+  with LogWriter(dest, compress) as writer:
+    writer.write_all(log_msgs)
+
+
+NUMERIC_TYPES = ('bool', 'int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64', 'float32', 'float64', 'enum')
+
+
+def _check_column_field(msg_type: str, path: str) -> bool:
+  """
+  Raise ValueError unless path, relative to msg_type, is a field with one number, enum, bool or text per message, or a
+  list of numbers, enums or bools. Returns whether it is a list.
+  """
+  try:
+    schema = capnp_log.Event.schema.fields[msg_type].schema
+    *parents, name = path.split(".")
+    for parent in parents:
+      field = schema.fields[parent]
+      if field.proto.which() == 'slot' and field.proto.slot.type.which() != 'struct':
+        raise KeyError(parent)
+      schema = field.schema
+    field = schema.fields[name]
+  except KeyError:
+    raise ValueError(f"{msg_type} has no field {path}") from None
+
+  field_type = field.proto.slot.type if field.proto.which() == 'slot' else None
+  if field_type is not None and field_type.which() == 'list' and field_type.list.elementType.which() in NUMERIC_TYPES:
+    return True
+  if field_type is None or field_type.which() not in (*NUMERIC_TYPES, 'text'):
+    raise ValueError(f"{msg_type}.{path} can't be read into a column, only numbers, enums, bools, text and lists of " +
+                     "numbers, enums and bools can")
+  return False
+
+
+def _column_value(value):
+  # copy out of the reader, so the event (and the buffer it was decoded from) can be freed
+  if isinstance(value, capnp.lib.capnp._DynamicEnum):
+    return value.raw
+  return value
+
+
+def _list_column_value(value):
+  return [v.raw if isinstance(v, capnp.lib.capnp._DynamicEnum) else v for v in value]
+
+
+def _list_column_array(msg_type: str, path: str, values: list[list]) -> np.ndarray:
+  lengths = {len(v) for v in values}
+  if len(lengths) > 1:
+    raise ValueError(f"{msg_type}.{path} has lists of different lengths {sorted(lengths)}, only fixed length lists can be " +
+                     "read into a column")
+  return np.array(values).reshape(len(values), lengths.pop() if len(lengths) else 0)
+
+
+def _decompress_zstd(dat) -> bytes:
+  # streaming compressors (loggerd, LogWriter) don't record the decompressed size in their frame headers
+  with zstd.ZstdDecompressor().stream_reader(dat, read_across_frames=True) as reader:
+    return reader.read()
+
+
+def _decompress_chunks(chunks: Iterator[bytes], ext: str | None) -> Iterator[bytes]:
+  first = next(chunks, b"")
+  chunks = itertools.chain([first], chunks)
+
+  new_decompressor: Callable[[], bz2.BZ2Decompressor | zstd.ZstdDecompressionObj]
+  if ext == ".bz2" or first.startswith(b'BZh9'):
+    new_decompressor = bz2.BZ2Decompressor
+  elif ext == ".zst" or first.startswith(ZSTD_MAGIC):
+    new_decompressor = zstd.ZstdDecompressor().decompressobj
+  else:
+    yield from chunks
+    return
+
+  decompressor = new_decompressor()
+  for chunk in chunks:
+    while chunk:
+      yield decompressor.decompress(chunk)
+      chunk = b""
+      # files can be made of several concatenated streams
+      if decompressor.eof:
+        chunk = decompressor.unused_data
+        decompressor = new_decompressor()
+
+
+def _map_log(fn: str) -> mmap.mmap | None:
+  # only local files that are not compressed can be decoded in place
+  if fn.startswith(("http://", "https://", "cd:/")) or not os.path.isfile(fn):
+    return None
+  with open(fn, "rb") as f:
+    if os.fstat(f.fileno()).st_size == 0 or f.read(4) in (b'BZh9', ZSTD_MAGIC):
+      return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
 
 class _LogFileReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None, stream=False,
+               services: Iterable[str] | None = None, time_range: TimeRange | None = None, use_index=False, use_mmap=False,
+               log_cache: LogCacheFormat | None = None):
     self.data_version = None
     self._only_union_types = only_union_types
+    self._services = None if services is None else frozenset(services)
+    self._time_range = time_range
+    self._fn = fn
+    # file actually read, a cached copy of fn if there is one
+    self._path = fn
+    self._ext = None
+    self._ents: list[capnp._DynamicStructReader] | None = None
+    # events reference the mapped pages directly, the mapping stays open as long as any of them does
+    self._mmap = None
+    # size of the decompressed log held in memory
+    self.nbytes = 0
+
+    # sidecar index of the events in the file, cached next to the other tools caches
+    # files that can't be told apart from a rewritten version of themselves are not indexed
+    self._signature = file_signature(fn) if use_index and not dat else None
+    self._use_index = self._signature is not None
+    self._index: LogIndex | None = load_log_index(fn, self._signature) if self._signature is not None else None
 
-    ext = None
     if not dat:
-      _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-      if ext not in ('', '.bz2', '.zst'):
+      _, self._ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+      if self._ext not in ('', '.bz2', '.zst'):
         # old rlogs weren't compressed
-        raise Exception(f"unknown extension {ext}")
+        raise Exception(f"unknown extension {self._ext}")
 
-      with FileReader(fn) as f:
-        dat = f.read()
+      # no need to read the file at all if none of its events are wanted
+      if self._index is not None and len(self._selected(self._index)) == 0:
+        self._ents = []
+        return
 
-    if ext == ".bz2" or dat.startswith(b'BZh9'):
-      dat = bz2.decompress(dat)
-    elif ext == ".zst" or dat.startswith(b'\x28\xB5\x2F\xFD'):
-      # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
-      dat = zstd.decompress(dat)
+      # read from the local cache of decompressed logs, filling it on first use
+      if log_cache is not None and (path := cached_log_path(fn, log_cache, self._ext)) is not None:
+        if not touch_log(path):
+          with FileReader(fn) as f:
+            store_log(path, _decompress_chunks(iter(partial(f.read, STREAM_CHUNK_SIZE), b""), self._ext), log_cache)
+        self._path, self._ext = path, CACHE_EXT[log_cache]
 
-    ents = capnp_log.Event.read_multiple_bytes(dat)
+      if use_mmap and self._ext == '':
+        self._mmap = _map_log(self._path)
+
+      # events are decoded while iterating, sorting needs all of them up front
+      if stream and not sort_by_time:
+        return
+
+      if self._mmap is not None:
+        dat = self._mmap
+      else:
+        with FileReader(self._path) as f:
+          dat = f.read()
+
+    # mapped logs are not compressed, and their pages belong to the page cache rather than to this reader
+    if self._mmap is None:
+      if self._ext == ".bz2" or dat.startswith(b'BZh9'):
+        dat = bz2.decompress(dat)
+      elif self._ext == ".zst" or dat.startswith(ZSTD_MAGIC):
+        dat = _decompress_zstd(dat)
+      self.nbytes = len(dat)
+
+    if self._index is not None and self._index.data_len != len(dat):
+      self._index = None
+
+    if self._index is not None:
+      ents = self._decode_selected(memoryview(dat), self._index)
+    elif self._services is None and self._time_range is None and not self._use_index:
+      ents = capnp_log.Event.read_multiple_bytes(dat)
+    else:
+      ents = self._decode_wanted(memoryview(dat)[offset:offset + size] for offset, size in iter_events(dat))
 
     self._ents = []
     try:
       for e in ents:
         self._ents.append(e)
-    except capnp.KjException:
+    except (capnp.KjException, FramingError):
       warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
 
     if sort_by_time:
       self._ents.sort(key=lambda x: x.logMonoTime)
 
+  def _selected(self, index: LogIndex) -> np.ndarray:
+    return index.select(self._services, self._time_range)
+
+  def _wanted(self, dat) -> bool:
+    if self._services is None and self._time_range is None:
+      return True
+    mono_time, which = read_event_header(dat)
+    if self._services is not None and EVENT_TYPES.get(which) not in self._services:
+      return False
+    return self._time_range is None or in_time_range(mono_time, self._time_range)
+
+  def _decode_selected(self, dat, index: LogIndex) -> Iterator[capnp._DynamicStructReader]:
+    selected = self._selected(index)
+    for offset, size in zip(index.offsets[selected].tolist(), index.sizes[selected].tolist(), strict=True):
+      with capnp_log.Event.from_bytes(dat[offset:offset + size]) as ent:
+        yield ent
+
+  def _decode_wanted(self, events: Iterable) -> Iterator[capnp._DynamicStructReader]:
+    # unwanted events are skipped based on their header, without building a reader for them
+    index = self._index
+    index_builder = LogIndexBuilder() if self._use_index and index is None else None
+    if index is not None:
+      selected = self._selected(index)
+      wanted_sizes = dict(zip(index.offsets[selected].tolist(), index.sizes[selected].tolist(), strict=True))
+      last_offset = max(wanted_sizes, default=-1)
+
+    offset = 0
+    for dat in events:
+      if index is not None:
+        # nothing left to read past the last wanted event
+        if offset > last_offset:
+          return
+        wanted = offset in wanted_sizes
+        if wanted and wanted_sizes[offset] != len(dat):
+          self._stale_index()
+      else:
+        wanted = self._wanted(dat)
+
+      if index_builder is not None:
+        index_builder.add(dat)
+      if wanted:
+        with capnp_log.Event.from_bytes(dat) as ent:
+          yield ent
+      offset += len(dat)
+
+    if index is not None and offset != index.data_len:
+      self._stale_index()
+    if index_builder is not None:
+      assert self._signature is not None
+      self._index = index_builder.finish(self._signature)
+      self._index.save(log_index_path(self._fn))
+
+  def _stale_index(self):
+    # the file changed without its size or modification time changing, it gets indexed again next time
+    remove_log_index(self._fn)
+    raise StaleLogIndexError(f"index of {self._fn} doesn't match the file")
+
+  def _stream_ents(self) -> Iterator[capnp._DynamicStructReader]:
+    if self._mmap is not None:
+      if self._index is not None and self._index.data_len != len(self._mmap):
+        self._index = None
+      dat = memoryview(self._mmap)
+      try:
+        if self._index is not None:
+          yield from self._decode_selected(dat, self._index)
+        else:
+          yield from self._decode_wanted(dat[offset:offset + size] for offset, size in iter_events(dat))
+      except (capnp.KjException, FramingError):
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+      return
+
+    with FileReader(self._path) as f:
+      chunks = iter(partial(f.read, STREAM_CHUNK_SIZE), b"")
+      try:
+        yield from self._decode_wanted(split_events(_decompress_chunks(chunks, self._ext)))
+      except (capnp.KjException, FramingError):
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  def iter_raw(self) -> RawLogIterable:
+    """Bytes of each wanted event as stored in the file, in file order, without decoding them"""
+    if self._mmap is not None:
+      events = (self._mmap[offset:offset + size] for offset, size in iter_events(self._mmap))
+      yield from (dat for dat in events if self._wanted_raw(dat))
+      return
+
+    with FileReader(self._path) as f:
+      chunks = iter(partial(f.read, STREAM_CHUNK_SIZE), b"")
+      try:
+        yield from (dat for dat in split_events(_decompress_chunks(chunks, self._ext)) if self._wanted_raw(dat))
+      except FramingError:
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  def _wanted_raw(self, dat) -> bool:
+    if self._only_union_types and read_event_header(dat)[1] not in EVENT_TYPES:
+      return False
+    return self._wanted(dat)
+
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
-    for ent in self._ents:
+    ents = self._stream_ents() if self._ents is None else self._ents
+    for ent in ents:
       if self._only_union_types:
         try:
           ent.which()
@@ -84,6 +339,52 @@ class _LogFileReader:
         yield ent
 
 
+def _run_on_file(func, lr_kwargs, identifier):
+  return func(_LogFileReader(identifier, **lr_kwargs))
+
+
+class _SegmentCache:
+  """Loaded segments by index, evicting the least recently used ones once they hold more than max_bytes"""
+
+  def __init__(self, max_bytes: int | None = None):
+    self.max_bytes = max_bytes
+    self._lrs: OrderedDict[int, _LogFileReader] = OrderedDict()
+    self._nbytes = 0
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    # loaded segments are not sent to other processes
+    return self.max_bytes
+
+  def __setstate__(self, max_bytes):
+    self.__init__(max_bytes)
+
+  def get(self, i: int) -> _LogFileReader | None:
+    with self._lock:
+      lr = self._lrs.get(i)
+      if lr is not None:
+        self._lrs.move_to_end(i)
+      return lr
+
+  def put(self, i: int, lr: _LogFileReader) -> None:
+    with self._lock:
+      self._pop(i)
+      self._lrs[i] = lr
+      self._nbytes += lr.nbytes
+      # the newest segment is kept even if it alone exceeds the budget
+      while self.max_bytes is not None and self._nbytes > self.max_bytes and len(self._lrs) > 1:
+        self._pop(next(iter(self._lrs)))
+
+  def pop(self, i: int) -> None:
+    with self._lock:
+      self._pop(i)
+
+  def _pop(self, i: int) -> None:
+    lr = self._lrs.pop(i, None)
+    if lr is not None:
+      self._nbytes -= lr.nbytes
+
+
 class ReadMode(enum.StrEnum):
   RLOG = "r"  # only read rlogs
   QLOG = "q"  # only read qlogs
@@ -99,14 +400,106 @@ Source = Callable[[SegmentRange, ReadMode], list[LogPath]]
 InternalUnavailableException = Exception("Internal source not available")
 
 
-@cache
+class _ProbeCache:
+  """file_exists results, shared between threads. Least recently used entries are dropped past max_size"""
+
+  def __init__(self, max_size: int = MAX_PROBE_CACHE_SIZE, missing_ttl: float = MISSING_FILE_TTL):
+    self.max_size = max_size
+    self.missing_ttl = missing_ttl
+    self._results: OrderedDict[str, tuple[bool, float]] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __call__(self, fn: str) -> bool:
+    with self._lock:
+      result = self._results.get(fn)
+      if result is not None:
+        exists, checked_at = result
+        if exists or time.monotonic() - checked_at < self.missing_ttl:
+          self._results.move_to_end(fn)
+          return exists
+
+    exists = bool(file_exists(fn))
+    with self._lock:
+      self._results[fn] = (exists, time.monotonic())
+      self._results.move_to_end(fn)
+      while len(self._results) > self.max_size:
+        self._results.popitem(last=False)
+    return exists
+
+  def clear(self) -> None:
+    with self._lock:
+      self._results.clear()
+
+
+class _DaemonThreadPool(Executor):
+  """
+  Thread pool on daemon threads. Unlike ThreadPoolExecutor, the interpreter doesn't wait for it at exit, so checks of a
+  source that is not needed anymore don't keep a script from exiting once it has its files.
+  """
+
+  def __init__(self, max_workers: int):
+    self.max_workers = max_workers
+    self._queue: queue.SimpleQueue = queue.SimpleQueue()
+    self._num_threads = 0
+    self._idle = 0
+    self._lock = threading.Lock()
+
+  def submit(self, fn, /, *args, **kwargs) -> Future:
+    future: Future = Future()
+    self._queue.put((future, fn, args, kwargs))
+    with self._lock:
+      if self._idle == 0 and self._num_threads < self.max_workers:
+        self._num_threads += 1
+        threading.Thread(target=self._work, daemon=True).start()
+    return future
+
+  def _work(self) -> None:
+    while True:
+      with self._lock:
+        self._idle += 1
+      future, fn, args, kwargs = self._queue.get()
+      with self._lock:
+        self._idle -= 1
+      if not future.set_running_or_notify_cancel():
+        continue
+      try:
+        future.set_result(fn(*args, **kwargs))
+      except BaseException as e:
+        future.set_exception(e)
+
+
+_probe_cache = _ProbeCache()
+_probe_executor: _DaemonThreadPool | None = None
+_source_executor: _DaemonThreadPool | None = None
+
+
+def probe_executor() -> _DaemonThreadPool:
+  global _probe_executor
+  if _probe_executor is None:
+    _probe_executor = _DaemonThreadPool(max_workers=MAX_PROBE_WORKERS)
+  return _probe_executor
+
+
+def source_executor() -> _DaemonThreadPool:
+  # separate from the probe executor, which the sources use themselves
+  global _source_executor
+  if _source_executor is None:
+    _source_executor = _DaemonThreadPool(max_workers=MAX_PROBE_WORKERS)
+  return _source_executor
+
+
 def default_valid_file(fn: LogPath) -> bool:
-  return fn is not None and file_exists(fn)
+  return fn is not None and _probe_cache(fn)
+
+
+def _valid_files(files: list[LogPath], valid_file: ValidFileCallable) -> list[bool]:
+  return list(probe_executor().map(lambda fn: fn is not None and valid_file(fn), files))
 
 
 def auto_strategy(rlog_paths: list[LogPath], qlog_paths: list[LogPath], interactive: bool, valid_file: ValidFileCallable) -> list[LogPath]:
   # auto select logs based on availability
-  missing_rlogs = [rlog is None or not valid_file(rlog) for rlog in rlog_paths].count(True)
+  valid_rlogs = _valid_files(rlog_paths, valid_file)
+  missing_rlogs = valid_rlogs.count(False)
   if missing_rlogs != 0:
     if interactive:
       if input(f"{missing_rlogs}/{len(rlog_paths)} rlogs were not found, would you like to fallback to qlogs for those segments? (y/n) ").lower() != "y":
@@ -114,8 +507,9 @@ def auto_strategy(rlog_paths: list[LogPath], qlog_paths: list[LogPath], interact
     else:
       cloudlog.warning(f"{missing_rlogs}/{len(rlog_paths)} rlogs were not found, falling back to qlogs for those segments...")
 
-    return [rlog if valid_file(rlog) else (qlog if valid_file(qlog) else None)
-            for (rlog, qlog) in zip(rlog_paths, qlog_paths, strict=True)]
+    valid_qlogs = iter(_valid_files([qlog for qlog, valid in zip(qlog_paths, valid_rlogs, strict=True) if not valid], valid_file))
+    return [rlog if valid else (qlog if next(valid_qlogs) else None)
+            for (rlog, qlog, valid) in zip(rlog_paths, qlog_paths, valid_rlogs, strict=True)]
   return rlog_paths
 
 
@@ -188,9 +582,15 @@ def direct_source(file_or_url: str) -> list[LogPath]:
 
 
 def get_invalid_files(files):
-  for f in files:
-    if f is None or not file_exists(f):
-      yield f
+  # checked concurrently, invalid files are yielded as soon as they are found
+  futures = {probe_executor().submit(default_valid_file, f): f for f in files}
+  try:
+    for future in as_completed(futures):
+      if not future.result():
+        yield futures[future]
+  finally:
+    for future in futures:
+      future.cancel()
 
 
 def check_source(source: Source, *args) -> list[LogPath]:
@@ -200,6 +600,41 @@ def check_source(source: Source, *args) -> list[LogPath]:
   return files
 
 
+def _first_valid_source(sources: list[Source], sr: SegmentRange, mode: ReadMode, exceptions: dict[str, Exception],
+                        concurrent=True) -> list[LogPath] | None:
+  """
+  Files of the first source in the list that has all of them. Sources are checked in order of preference, the next one
+  is started early, alongside the ones before it, when those take longer than SOURCE_START_DELAY.
+  """
+  if not concurrent:
+    for source in sources:
+      try:
+        return check_source(source, sr, mode)
+      except Exception as e:
+        exceptions[source.__name__] = e
+    return None
+
+  futures: list[Future[list[LogPath]]] = []
+  start_next = 0.
+  try:
+    for i, source in enumerate(sources):
+      while not (len(futures) > i and futures[i].done()):
+        if len(futures) <= i or (len(futures) < len(sources) and time.monotonic() >= start_next):
+          futures.append(source_executor().submit(check_source, sources[len(futures)], sr, mode))
+          start_next = time.monotonic() + SOURCE_START_DELAY
+        else:
+          wait([futures[i]], timeout=max(start_next - time.monotonic(), 0) if len(futures) < len(sources) else None)
+      try:
+        return futures[i].result()
+      except Exception as e:
+        exceptions[source.__name__] = e
+    return None
+  finally:
+    # less preferred sources not started yet are skipped, the ones being checked are abandoned
+    for future in futures:
+      future.cancel()
+
+
 def auto_source(sr: SegmentRange, mode=ReadMode.RLOG, sources: list[Source] = None) -> list[LogPath]:
   if mode == ReadMode.SANITIZED:
     return comma_car_segments_source(sr, mode)
@@ -207,22 +642,18 @@ def auto_source(sr: SegmentRange, mode=ReadMode.RLOG, sources: list[Source] = No
   if sources is None:
     sources = [internal_source, internal_source_zst, openpilotci_source, openpilotci_source_zst,
                comma_api_source, comma_car_segments_source, testing_closet_source]
-  exceptions = {}
+  exceptions: dict[str, Exception] = {}
 
   # for automatic fallback modes, auto_source needs to first check if rlogs exist for any source
   if mode in [ReadMode.AUTO, ReadMode.AUTO_INTERACTIVE]:
-    for source in sources:
-      try:
-        return check_source(source, sr, ReadMode.RLOG)
-      except Exception:
-        pass
+    files = _first_valid_source(sources, sr, ReadMode.RLOG, {})
+    if files is not None:
+      return files
 
-  # Automatically determine viable source
-  for source in sources:
-    try:
-      return check_source(source, sr, mode)
-    except Exception as e:
-      exceptions[source.__name__] = e
+  # Automatically determine viable source, one at a time if the user may be prompted
+  files = _first_valid_source(sources, sr, mode, exceptions, concurrent=mode != ReadMode.AUTO_INTERACTIVE)
+  if files is not None:
+    return files
 
   raise Exception("auto_source could not find any valid source, exceptions for sources:\n  - " +
                   "\n  - ".join([f"{k}: {repr(v)}" for k, v in exceptions.items()]))
@@ -262,7 +693,10 @@ class LogReader:
     return identifiers
 
   def __init__(self, identifier: str | list[str], default_mode: ReadMode = ReadMode.RLOG,
-               source: Source = auto_source, sort_by_time=False, only_union_types=False):
+               source: Source = auto_source, sort_by_time=False, only_union_types=False, stream=False,
+               services: Iterable[str] | None = None, time_range: TimeRange | None = None, use_index=False, prefetch=0,
+               cache_bytes: int | None = None, release_segments=False, use_mmap=False,
+               log_cache: LogCacheFormat | None = None):
     self.default_mode = default_mode
     self.source = source
     self.identifier = identifier
@@ -271,29 +705,88 @@ class LogReader:
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
-
-    self.__lrs: dict[int, _LogFileReader] = {}
+    # decode events incrementally while iterating, keeping memory flat regardless of segment size
+    self.stream = stream
+    # only decode events of these types, others are skipped without being parsed
+    self.services = services
+    # only decode events with start <= logMonoTime < end
+    self.time_range = time_range
+    # keep a sidecar index per log file, so later reads of a slice skip everything outside of it
+    self.use_index = use_index
+    # number of segments to download and decompress in the background while iterating
+    self.prefetch = prefetch
+    # decode local uncompressed logs straight from a memory map of the file, processes reading the same file share its pages
+    self.use_mmap = use_mmap
+    # keep a local copy of each log, recompressed as zstd or decompressed, so later runs skip downloading and bz2
+    self.log_cache = None if log_cache is None else LogCacheFormat(log_cache)
+
+    # decompressed segments are kept in memory for later iterations, up to cache_bytes
+    self.__lrs = _SegmentCache(cache_bytes)
+    # drop each segment as soon as iteration is done with it
+    self.release_segments = release_segments
     self.reset()
 
   def _get_lr(self, i):
-    if i not in self.__lrs:
-      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
-    return self.__lrs[i]
+    lr = self.__lrs.get(i)
+    if lr is None:
+      lr = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types,
+                          stream=self.stream, services=self.services, time_range=self.time_range, use_index=self.use_index,
+                          use_mmap=self.use_mmap, log_cache=self.log_cache)
+      self.__lrs.put(i, lr)
+    return lr
+
+  def _release(self, i):
+    if self.release_segments:
+      self.__lrs.pop(i)
 
   def __iter__(self):
-    for i in range(len(self.logreader_identifiers)):
-      yield from self._get_lr(i)
+    num_segs = len(self.logreader_identifiers)
+    if self.prefetch <= 0:
+      for i in range(num_segs):
+        yield from self._get_lr(i)
+        self._release(i)
+      return
+
+    # decompression and downloads release the GIL, so threads are enough to overlap them with the consumer
+    pool = ThreadPoolExecutor(max_workers=self.prefetch)
+    try:
+      futures: dict[int, Future] = {}
+      for i in range(num_segs):
+        for j in range(i, min(i + self.prefetch + 1, num_segs)):
+          if j not in futures:
+            futures[j] = pool.submit(self._get_lr, j)
+        yield from futures.pop(i).result()
+        self._release(i)
+    finally:
+      pool.shutdown(wait=False, cancel_futures=True)
+
+  def _lr_kwargs(self):
+    return {'sort_by_time': self.sort_by_time, 'only_union_types': self.only_union_types, 'stream': self.stream,
+            'services': self.services, 'time_range': self.time_range, 'use_index': self.use_index, 'use_mmap': self.use_mmap,
+            'log_cache': self.log_cache}
+
+  def iter_across_segments(self, num_processes, func, desc=None, ordered=True, chunksize=1):
+    """
+    Yield func's result for each segment as soon as it is done, in segment order unless ordered is False.
+    Workers only receive the segment's log path and read it themselves.
+    """
+    with multiprocessing.Pool(num_processes) as pool:
+      imap = pool.imap if ordered else pool.imap_unordered
+      num_segs = len(self.logreader_identifiers)
+      yield from tqdm.tqdm(imap(partial(_run_on_file, func, self._lr_kwargs()), self.logreader_identifiers, chunksize=chunksize),
+                           total=num_segs, desc=desc)
 
-  def _run_on_segment(self, func, i):
-    return func(self._get_lr(i))
+  def iter_raw(self) -> RawLogIterable:
+    """Bytes of every event as stored in the logs, e.g. to write them with LogWriter, without decoding them"""
+    kwargs = {**self._lr_kwargs(), 'sort_by_time': False, 'stream': True}
+    for identifier in self.logreader_identifiers:
+      yield from _LogFileReader(identifier, **kwargs).iter_raw()
 
   def run_across_segments(self, num_processes, func, desc=None):
-    with multiprocessing.Pool(num_processes) as pool:
-      ret = []
-      num_segs = len(self.logreader_identifiers)
-      for p in tqdm.tqdm(pool.imap(partial(self._run_on_segment, func), range(num_segs)), total=num_segs, desc=desc):
-        ret.extend(p)
-      return ret
+    ret = []
+    for p in self.iter_across_segments(num_processes, func, desc=desc):
+      ret.extend(p)
+    return ret
 
   def reset(self):
     self.logreader_identifiers = []
@@ -304,8 +797,50 @@ class LogReader:
   def from_bytes(dat):
     return _LogFileReader("", dat=dat)
 
+  def _iter_service(self, msg_type: str) -> Iterator[capnp._DynamicStructReader]:
+    for i, identifier in enumerate(self.logreader_identifiers):
+      lr = self.__lrs.get(i)
+      if lr is None:
+        lr = _LogFileReader(identifier, only_union_types=self.only_union_types, stream=True, services={msg_type},
+                            time_range=self.time_range, use_index=self.use_index, use_mmap=self.use_mmap,
+                            log_cache=self.log_cache)
+      yield from (m for m in lr if m.which() == msg_type)
+
+  def to_numpy(self, msg_type: str, fields: list[str]) -> dict[str, np.ndarray]:
+    """
+    Read fields of one service into one array per field path, relative to the service (e.g. "position.x" for modelV2),
+    along with the logMonoTime of each message. Segments not loaded yet are streamed and only msg_type is decoded.
+    Scalars give an array of shape (N,), fixed length lists of numbers, enums or bools one of shape (N, length). Structs,
+    lists of structs and lists whose length changes between messages are rejected with a ValueError.
+    """
+    is_list = [_check_column_field(msg_type, f) for f in fields]
+
+    getters = [operator.attrgetter(f) for f in fields]
+    converters = [_list_column_value if lst else _column_value for lst in is_list]
+    columns: list[list] = [[] for _ in fields]
+    mono_times = []
+    for m in self._iter_service(msg_type):
+      mono_times.append(m.logMonoTime)
+      msg = getattr(m, msg_type)
+      for getter, convert, column in zip(getters, converters, columns, strict=True):
+        column.append(convert(getter(msg)))
+
+    ret = {'logMonoTime': np.array(mono_times, dtype=np.uint64)}
+    for f, lst, column in zip(fields, is_list, columns, strict=True):
+      ret[f] = _list_column_array(msg_type, f, column) if lst else np.array(column)
+    return ret
+
+  def to_arrow(self, msg_type: str, fields: list[str]):
+    """Same as to_numpy, as a pyarrow Table"""
+    import pyarrow as pa
+
+    columns = self.to_numpy(msg_type, fields)
+    # lists become fixed size list columns
+    return pa.table({k: pa.FixedSizeListArray.from_arrays(v.reshape(-1), v.shape[1]) if v.ndim == 2 else v
+                     for k, v in columns.items()})
+
   def filter(self, msg_type: str):
-    return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
+    return (getattr(m, msg_type) for m in self if m.which() == msg_type)
 
   def first(self, msg_type: str):
     return next(self.filter(msg_type), None)
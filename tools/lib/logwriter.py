@@ -0,0 +1,72 @@
+import bz2
+
+import capnp
+import zstandard as zstd
+
+WRITE_CHUNK_SIZE = 1024 * 1024
+ZSTD_LEVEL = 10
+BZ2_LEVEL = 9
+
+
+class LogWriter:
+  """
+  Write events to a log file as they come, compressed according to its extension (.zst or .bz2). Events can be capnp
+  builders, readers or the raw bytes of an event. Only raw bytes are written as is: builders are serialized, and readers
+  are first copied into a builder. To copy events out of logs, write the bytes from LogReader.iter_raw instead of the
+  decoded events.
+  """
+
+  def __init__(self, dest: str, compress=True):
+    self._f = open(dest, "wb")
+    self._buf = bytearray()
+    self._compressor: zstd.ZstdCompressionObj | bz2.BZ2Compressor | None
+    if compress and dest.endswith(".zst"):
+      # zstd compresses on its own threads, alongside whatever is producing the events
+      self._compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL, threads=-1).compressobj()
+    elif compress and dest.endswith(".bz2"):
+      self._compressor = bz2.BZ2Compressor(BZ2_LEVEL)
+    else:
+      self._compressor = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def write(self, msg) -> None:
+    if isinstance(msg, bytes | bytearray | memoryview):
+      dat = msg
+    elif isinstance(msg, capnp.lib.capnp._DynamicStructBuilder):
+      dat = msg.to_bytes()
+    else:
+      dat = msg.as_builder().to_bytes()
+
+    # small events are batched, large blocks of events are written without copying them into the buffer first
+    if len(dat) >= WRITE_CHUNK_SIZE:
+      self._flush()
+      self._write(dat)
+    else:
+      self._buf += dat
+      if len(self._buf) >= WRITE_CHUNK_SIZE:
+        self._flush()
+
+  def write_all(self, msgs) -> None:
+    for msg in msgs:
+      self.write(msg)
+
+  def _write(self, dat) -> None:
+    self._f.write(self._compressor.compress(dat) if self._compressor is not None else dat)
+
+  def _flush(self) -> None:
+    if len(self._buf):
+      self._write(self._buf)
+      self._buf.clear()
+
+  def close(self) -> None:
+    if self._f.closed:
+      return
+    self._flush()
+    if self._compressor is not None:
+      self._f.write(self._compressor.flush())
+    self._f.close()
@@ -1,12 +1,18 @@
+import json
 import os
 import re
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
 from functools import cache
 from urllib.parse import urlparse
 from collections import defaultdict
 from itertools import chain
 
+from openpilot.common.file_helpers import atomic_write_in_dir
 from openpilot.tools.lib.auth_config import get_token
 from openpilot.tools.lib.api import CommaApi
+from openpilot.tools.lib.cache import DEFAULT_CACHE_DIR
 from openpilot.tools.lib.helpers import RE
 
 QLOG_FILENAMES = ['qlog', 'qlog.bz2', 'qlog.zst']
@@ -16,6 +22,55 @@ CAMERA_FILENAMES = ['fcamera.hevc', 'video.hevc']
 DCAMERA_FILENAMES = ['dcamera.hevc']
 ECAMERA_FILENAMES = ['ecamera.hevc']
 
+# API responses about routes are kept on disk for this long. File listings hold signed urls, which expire
+ROUTE_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "routes")
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", str(15 * 60)))
+# concurrent API requests when resolving many routes
+MAX_API_WORKERS = 16
+
+
+def _cached_api_get(endpoint: str, ttl: float = ROUTE_CACHE_TTL):
+  path = os.path.join(ROUTE_CACHE_DIR, endpoint.strip("/").replace("/", "_").replace("|", "_") + ".json")
+  try:
+    if time.time() - os.path.getmtime(path) < ttl:
+      with open(path) as f:
+        return json.load(f)
+  except (OSError, ValueError):
+    pass
+
+  resp = CommaApi(get_token()).get(endpoint)
+  os.makedirs(ROUTE_CACHE_DIR, exist_ok=True)
+  with atomic_write_in_dir(path, mode="w", overwrite=True) as f:
+    json.dump(resp, f)
+  return resp
+
+
+def get_route_files(route_name: str) -> dict[str, list[str]]:
+  files: dict[str, list[str]] = _cached_api_get('v1/route/' + RouteName(route_name).canonical_name + '/files')
+  return files
+
+
+def get_route_info(route_name: str) -> dict:
+  info: dict = _cached_api_get('v1/route/' + RouteName(route_name).canonical_name)
+  return info
+
+
+def get_routes(route_names: Iterable[str], max_workers: int = MAX_API_WORKERS) -> dict[str, 'Route | Exception']:
+  """
+  Resolve many routes at once, with concurrent API requests. Routes that can't be resolved map to the exception
+  raised. Both the file listing and the route info are cached, so later Route and SegmentRange lookups are local.
+  """
+  def resolve(route_name):
+    try:
+      get_route_info(route_name)
+      return Route(route_name)
+    except Exception as e:
+      return e
+
+  route_names = list(dict.fromkeys(route_names))
+  with ThreadPoolExecutor(max_workers=max_workers) as pool:
+    return dict(zip(route_names, pool.map(resolve, route_names), strict=True))
+
 
 class Route:
   def __init__(self, name, data_dir=None):
@@ -61,8 +116,7 @@ class Route:
 
   # TODO: refactor this, it's super repetitive
   def _get_segments_remote(self):
-    api = CommaApi(get_token())
-    route_files = api.get('v1/route/' + self.name.canonical_name + '/files')
+    route_files = get_route_files(self.name.canonical_name)
     self.files = list(chain.from_iterable(route_files.values()))
 
     segments = {}
@@ -235,11 +289,14 @@ class SegmentName:
   def __str__(self) -> str: return self._canonical_name
 
 
-@cache
 def get_max_seg_number_cached(sr: 'SegmentRange') -> int:
+  return _get_max_seg_number(sr.route_name)
+
+
+@cache
+def _get_max_seg_number(route_name: str) -> int:
   try:
-    api = CommaApi(get_token())
-    max_seg_number = api.get("/v1/route/" + sr.route_name.replace("/", "|"))["maxqlog"]
+    max_seg_number = get_route_info(route_name)["maxqlog"]
     assert isinstance(max_seg_number, int)
     return max_seg_number
   except Exception as e:
@@ -1,6 +1,16 @@
+#!/usr/bin/env python3
 # Utilities for sanitizing routes of only essential data for testing car ports and doing validation.
+import argparse
+import multiprocessing
+import os
+import re
+import urllib.parse
 
-from openpilot.tools.lib.logreader import LogIterable, LogMessage
+from cereal import log as capnp_log
+from openpilot.tools.lib.log_framing import EVENT_TYPES
+from openpilot.tools.lib.log_index import read_event_header
+from openpilot.tools.lib.logreader import LogIterable, LogMessage, LogReader, RawLogIterable
+from openpilot.tools.lib.logwriter import LogWriter
 
 
 def sanitize_vin(vin: str):
@@ -9,10 +19,15 @@ def sanitize_vin(vin: str):
   return vin[:-VIN_SENSITIVE] + "X" * VIN_SENSITIVE
 
 
+def _sanitize_car_params(msg) -> None:
+  # msg is a builder
+  msg.carParams.carVin = sanitize_vin(msg.carParams.carVin)
+
+
 def sanitize_msg(msg: LogMessage) -> LogMessage:
   if msg.which() == "carParams":
     msg = msg.as_builder()
-    msg.carParams.carVin = sanitize_vin(msg.carParams.carVin)
+    _sanitize_car_params(msg)
     msg = msg.as_reader()
   return msg
 
@@ -24,3 +39,58 @@ def sanitize(lr: LogIterable) -> LogIterable:
   filtered = filter(lambda msg: msg.which() in PRESERVE_SERVICES, lr)
   sanitized = map(sanitize_msg, filtered)
   return sanitized
+
+
+def sanitize_raw(events: RawLogIterable) -> RawLogIterable:
+  """Same as sanitize on raw event bytes. Only events that need scrubbing are decoded, the rest are passed on as is"""
+  for dat in events:
+    which = EVENT_TYPES.get(read_event_header(dat)[1])
+    if which == "carParams":
+      with capnp_log.Event.from_bytes(dat) as msg:
+        builder = msg.as_builder()
+      _sanitize_car_params(builder)
+      yield builder.to_bytes()
+    elif which in PRESERVE_SERVICES:
+      yield dat
+
+
+def sanitize_file(src: str, dest: str) -> str:
+  """Sanitize one log file (path or url) into dest, compressed according to its extension"""
+  with LogWriter(dest) as writer:
+    writer.write_all(sanitize_raw(LogReader(src, services=PRESERVE_SERVICES).iter_raw()))
+  return dest
+
+
+def segment_num(src: str) -> int | None:
+  """Segment number of a log from its path, named after it is the directory it's in: <n>/rlog or <route>--<n>/rlog"""
+  m = re.search(r"(?:^|--)(\d+)$", os.path.basename(os.path.dirname(urllib.parse.urlparse(src).path)))
+  return int(m.group(1)) if m else None
+
+
+def sanitize_route(identifier: str, dest_dir: str, num_processes: int | None = None) -> list[str]:
+  """
+  Sanitize every log of a route (or anything else LogReader takes) into zstd compressed logs in dest_dir, named
+  <segment>--<log name>.zst, or <n>--<log name>.zst in the order of the logs for paths without a segment number.
+  Logs are processed in parallel, one per process.
+  """
+  srcs = LogReader(identifier).logreader_identifiers
+  dests = []
+  for n, src in enumerate(srcs):
+    seg = segment_num(src)
+    name = os.path.basename(urllib.parse.urlparse(src).path).split(".")[0]
+    dests.append(os.path.join(dest_dir, f"{n if seg is None else seg}--{name}.zst"))
+
+  os.makedirs(dest_dir, exist_ok=True)
+  with multiprocessing.Pool(num_processes) as pool:
+    return pool.starmap(sanitize_file, zip(srcs, dests, strict=True))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Sanitize a route for sharing, keeping only what car ports need")
+  parser.add_argument("route", type=str)
+  parser.add_argument("dest_dir", type=str)
+  parser.add_argument("-j", "--jobs", type=int, default=None)
+  args = parser.parse_args()
+
+  for fn in sanitize_route(args.route, args.dest_dir, args.jobs):
+    print(fn)
@@ -0,0 +1,31 @@
+import shutil
+
+import av
+import numpy as np
+import pytest
+
+W, H = 64, 48
+NUM_FRAMES = 25
+
+
+def encode_hevc(fn, num_frames=NUM_FRAMES, w=W, h=H, gop_size=10):
+  """Write an annex B hevc stream like the cameras', I and P frames only"""
+  with av.open(fn, "w", format="hevc") as container:
+    stream = container.add_stream("libx265", rate=20)
+    stream.width, stream.height, stream.pix_fmt = w, h, "yuv420p"
+    stream.options = {"x265-params": f"keyint={gop_size}:min-keyint={gop_size}:bframes=0:log-level=none"}
+    for i in range(num_frames):
+      img = np.zeros((h, w, 3), dtype=np.uint8)
+      img[..., 0] = 10 * i
+      img[:, :w // 2, 1] = 200
+      img[h // 2:, :, 2] = 100
+      for packet in stream.encode(av.VideoFrame.from_ndarray(img, format="rgb24")):
+        container.mux(packet)
+    for packet in stream.encode():
+      container.mux(packet)
+
+
+@pytest.fixture
+def no_ffmpeg(tmp_path, monkeypatch):
+  monkeypatch.setenv("PATH", str(tmp_path / "empty"))
+  assert shutil.which("ffmpeg") is None
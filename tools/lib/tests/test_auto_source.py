@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from openpilot.tools.lib import logreader
+from openpilot.tools.lib.logreader import ReadMode, _first_valid_source
+
+
+class TestFirstValidSource:
+  @pytest.fixture(autouse=True)
+  def setup(self, tmp_path, monkeypatch):
+    monkeypatch.setattr(logreader, "SOURCE_START_DELAY", 0.2)
+    self.fn = str(tmp_path / "rlog.bz2")
+    with open(self.fn, "wb"):
+      pass
+    self.started: list[str] = []
+
+  def source(self, name, delay=0., valid=True):
+    def check(sr, mode):
+      self.started.append(name)
+      time.sleep(delay)
+      if not valid:
+        raise Exception(f"{name} has no files")
+      return [self.fn]
+    check.__name__ = name
+    return check
+
+  def test_less_preferred_not_started(self):
+    sources = [self.source("a"), self.source("b")]
+    assert _first_valid_source(sources, None, ReadMode.RLOG, {}) == [self.fn]
+    time.sleep(0.3)
+    assert self.started == ["a"]
+
+  def test_next_started_on_failure(self):
+    exceptions: dict[str, Exception] = {}
+    sources = [self.source("a", valid=False), self.source("b", valid=False), self.source("c")]
+    t = time.monotonic()
+    assert _first_valid_source(sources, None, ReadMode.RLOG, exceptions) == [self.fn]
+    assert time.monotonic() - t < 0.2
+    assert self.started == ["a", "b", "c"]
+    assert list(exceptions) == ["a", "b"]
+
+  def test_slow_source_preferred(self):
+    sources = [self.source("a", delay=0.5), self.source("b"), self.source("c", valid=False)]
+    assert _first_valid_source(sources, None, ReadMode.RLOG, {}) == [self.fn]
+    # b and c were started while waiting on a, but a has the files and comes first
+    assert self.started == ["a", "b", "c"]
+
+  def test_abandoned_source_does_not_block_exit(self, tmp_path):
+    script = textwrap.dedent(f"""
+      import time
+      from openpilot.tools.lib import logreader
+      from openpilot.tools.lib.logreader import ReadMode, _first_valid_source
+      logreader.SOURCE_START_DELAY = 0.05
+
+      def slow(sr, mode):
+        time.sleep(0.2)
+        return [{self.fn!r}]
+
+      def hanging(sr, mode):
+        time.sleep(600)
+
+      assert _first_valid_source([slow, hanging], None, ReadMode.RLOG, {{}}) == [{self.fn!r}]
+    """)
+    subprocess.run([sys.executable, "-c", script], check=True, timeout=30, env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)})
@@ -0,0 +1,46 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from openpilot.tools.lib.framereader import FrameReader, decode_video_data, decode_video_data_av, decompress_video_data
+from openpilot.tools.lib.tests.conftest import H, NUM_FRAMES, W, encode_hevc
+
+PIX_FMTS = ["yuv420p", "nv12", "rgb24", "yuv444p"]
+
+
+class TestFrameReader:
+  @pytest.fixture(autouse=True)
+  def setup(self, tmp_path):
+    self.fn = str(tmp_path / "fcamera.hevc")
+    encode_hevc(self.fn)
+    with open(self.fn, "rb") as f:
+      self.rawdat = f.read()
+
+  @pytest.mark.parametrize("pix_fmt", PIX_FMTS)
+  def test_decode_without_ffmpeg(self, no_ffmpeg, pix_fmt):
+    # every frame, the last one included, comes out of libav without falling back to ffmpeg
+    frames = decode_video_data(self.rawdat, "hevc", W, H, pix_fmt, num_frames=NUM_FRAMES)
+    assert frames.shape[0] == NUM_FRAMES
+
+  @pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+  @pytest.mark.parametrize("pix_fmt", PIX_FMTS)
+  def test_av_matches_ffmpeg(self, pix_fmt):
+    expected = decompress_video_data(self.rawdat, "hevc", W, H, pix_fmt)
+    assert np.array_equal(decode_video_data_av(self.rawdat, "hevc", W, H, pix_fmt), expected)
+
+  def test_frame_reader_without_ffmpeg(self, no_ffmpeg, tmp_path):
+    expected = decode_video_data_av(self.rawdat, "hevc", W, H, "rgb24")
+    fr = FrameReader(self.fn, cache_dir=str(tmp_path / "cache"), readahead=True)
+    assert fr.frame_count == NUM_FRAMES
+    # spans two GOPs, then again from the frame cache and the GOPs read ahead
+    assert np.array_equal(fr.get_batch(8, count=4, pix_fmt="rgb24"), expected[8:12])
+    assert np.array_equal(fr.get_batch(8, count=17, pix_fmt="rgb24"), expected[8:])
+    fr.close()
+
+  def test_frame_cache_size(self, tmp_path):
+    # sized after the stream by default, 64 rgb frames
+    with FrameReader(self.fn, cache_dir=str(tmp_path / "cache")) as fr:
+      assert fr.frame_cache.max_bytes == 64 * H * W * 3
+    with FrameReader(self.fn, cache_dir=str(tmp_path / "cache"), cache_bytes=1024 ** 3) as fr:
+      assert fr.frame_cache.max_bytes == 1024 ** 3
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from openpilot.tools.lib.framereader import FrameType, decode_video_data_av, get_video_index
+from openpilot.tools.lib.framesampler import _decode_frames, sample_frame_ids
+from openpilot.tools.lib.tests.conftest import H, W, encode_hevc
+
+
+class TestFrameSampler:
+  @pytest.fixture(autouse=True)
+  def setup(self, tmp_path):
+    self.fn = str(tmp_path / "fcamera.hevc")
+    encode_hevc(self.fn)
+    self.index_data = get_video_index(self.fn, FrameType.h265_stream, cache_dir=str(tmp_path / "cache"))
+    with open(self.fn, "rb") as f:
+      self.expected = decode_video_data_av(f.read(), "hevc", W, H, "rgb24")
+
+  def test_sample_frame_ids(self):
+    # 20 fps stream, GOPs of 10 frames
+    assert sample_frame_ids(self.index_data['index'], 5.) == [[0, 4, 8], [12, 16], [20, 24]]
+    assert sample_frame_ids(self.index_data['index'], 5., keyframes_only=True) == [[0], [10], [20]]
+
+  @pytest.mark.usefixtures("no_ffmpeg")
+  @pytest.mark.parametrize("frame_ids", [[0], [2, 5], [10, 19], [24]])
+  def test_decode_frames_without_ffmpeg(self, frame_ids):
+    frames = _decode_frames(self.fn, self.index_data, frame_ids, "rgb24")
+    assert np.array_equal(np.stack(frames), self.expected[frame_ids])
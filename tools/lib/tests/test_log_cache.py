@@ -0,0 +1,42 @@
+import os
+import pytest
+from functools import partial
+
+from cereal import log as capnp_log
+from openpilot.tools.lib import log_cache, logreader
+from openpilot.tools.lib.log_cache import LogCacheFormat, cached_log_path
+from openpilot.tools.lib.logreader import _LogFileReader
+from openpilot.tools.lib.logwriter import LogWriter
+
+
+class TestLogCache:
+  @pytest.fixture(autouse=True)
+  def setup(self, tmp_path, monkeypatch):
+    self.cache_dir = str(tmp_path / "cache")
+    monkeypatch.setattr(logreader, "cached_log_path", partial(cached_log_path, cache_dir=self.cache_dir))
+    self.fn = str(tmp_path / "rlog.bz2")
+    with LogWriter(self.fn) as writer:
+      for i in range(100):
+        writer.write(capnp_log.Event.new_message(logMonoTime=i, carState={}))
+
+  def read(self, fmt, **kwargs):
+    return [ent.logMonoTime for ent in _LogFileReader(self.fn, log_cache=fmt, **kwargs)]
+
+  @pytest.mark.parametrize("fmt", list(LogCacheFormat))
+  @pytest.mark.parametrize("stream", [False, True])
+  def test_cache_hit(self, fmt, stream):
+    assert self.read(fmt, stream=stream) == list(range(100))
+    assert len(os.listdir(self.cache_dir)) == 1
+    assert self.read(fmt, stream=stream) == list(range(100))
+
+  def test_store_keeps_new_entry(self, monkeypatch):
+    # a cache too small for even one log
+    monkeypatch.setattr(log_cache, "evict_log_cache", partial(log_cache.evict_log_cache, max_size=1))
+    os.makedirs(self.cache_dir)
+    old = os.path.join(self.cache_dir, "old.zst")
+    with open(old, "wb") as f:
+      f.write(b"\x00" * 100)
+    os.utime(old, (0, 0))
+
+    assert self.read(LogCacheFormat.ZST) == list(range(100))
+    assert os.listdir(self.cache_dir) == [os.path.basename(cached_log_path(self.fn, LogCacheFormat.ZST, ".bz2", self.cache_dir))]
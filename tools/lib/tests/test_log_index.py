@@ -0,0 +1,51 @@
+import os
+import pytest
+from functools import partial
+
+from cereal import log as capnp_log
+from openpilot.tools.lib import log_index, logreader
+from openpilot.tools.lib.log_index import StaleLogIndexError
+from openpilot.tools.lib.logreader import _LogFileReader
+
+
+def write_log(fn, services):
+  with open(fn, "wb") as f:
+    for i, s in enumerate(services):
+      msg = capnp_log.Event.new_message(logMonoTime=i)
+      msg.init(s)
+      f.write(msg.to_bytes())
+
+
+class TestLogIndex:
+  @pytest.fixture(autouse=True)
+  def setup(self, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    for f in ("load_log_index", "log_index_path", "remove_log_index"):
+      monkeypatch.setattr(logreader, f, partial(getattr(log_index, f), cache_dir=cache_dir))
+    self.fn = str(tmp_path / "rlog")
+    self.index_path = log_index.log_index_path(self.fn, cache_dir)
+
+  def read(self, **kwargs):
+    return [ent.which() for ent in _LogFileReader(self.fn, use_index=True, services=["carState"], **kwargs)]
+
+  @pytest.mark.parametrize("stream", [False, True])
+  def test_rewritten_file_is_reindexed(self, stream):
+    write_log(self.fn, ["carState", "controlsState"] * 5)
+    assert self.read(stream=stream) == ["carState"] * 5
+    assert os.path.exists(self.index_path)
+    assert self.read(stream=stream) == ["carState"] * 5
+
+    write_log(self.fn, ["carState", "controlsState", "controlsState"] * 8)
+    assert self.read(stream=stream) == ["carState"] * 8
+
+  def test_rewritten_file_without_new_signature_raises(self, monkeypatch):
+    monkeypatch.setattr(logreader, "file_signature", lambda fn: (0, 0))
+    write_log(self.fn, ["carState", "controlsState"] * 5)
+    assert self.read(stream=True) == ["carState"] * 5
+
+    write_log(self.fn, ["controlsState", "carState", "carState"] * 5)
+    with pytest.raises(StaleLogIndexError):
+      self.read(stream=True)
+    # rebuilt on the next read
+    assert not os.path.exists(self.index_path)
+    assert self.read(stream=True) == ["carState"] * 10
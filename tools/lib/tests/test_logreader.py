@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from cereal import car, log as capnp_log
+from openpilot.tools.lib.logreader import LogReader
+
+
+class TestToNumpy:
+  @pytest.fixture(autouse=True)
+  def setup(self, tmp_path):
+    self.fn = str(tmp_path / "rlog")
+    with open(self.fn, "wb") as f:
+      for i in range(10):
+        msg = capnp_log.Event.new_message(logMonoTime=i)
+        cs = msg.init("carState")
+        cs.vEgo = i
+        cs.cruiseState.speed = 2 * i
+        cs.gearShifter = "drive"
+        cs.init("buttonEvents", i % 3)
+        f.write(msg.to_bytes())
+        f.write(capnp_log.Event.new_message(logMonoTime=i, controlsState={}).to_bytes())
+        model = capnp_log.Event.new_message(logMonoTime=i)
+        model.init("modelV2").frameId = i
+        model.modelV2.position.x = [i + j for j in range(33)]
+        model.modelV2.laneLineProbs = [0.5] * (i % 2 + 1)
+        model.modelV2.meta.hardBrakePredicted = i % 2 == 0
+        f.write(model.to_bytes())
+
+  def test_scalar_fields(self):
+    cols = LogReader(self.fn).to_numpy("carState", ["vEgo", "cruiseState.speed", "gearShifter"])
+    assert np.array_equal(cols["logMonoTime"], np.arange(10))
+    assert np.allclose(cols["vEgo"], np.arange(10))
+    assert np.allclose(cols["cruiseState.speed"], 2 * np.arange(10))
+    assert np.all(cols["gearShifter"] == car.CarState.GearShifter.drive)
+
+  def test_list_fields(self):
+    cols = LogReader(self.fn).to_numpy("modelV2", ["frameId", "position.x", "meta.hardBrakePredicted"])
+    assert cols["position.x"].shape == (10, 33)
+    assert np.allclose(cols["position.x"], np.arange(10)[:, None] + np.arange(33))
+    assert np.array_equal(cols["frameId"], np.arange(10))
+    assert np.array_equal(cols["meta.hardBrakePredicted"], np.arange(10) % 2 == 0)
+
+  def test_arrow(self):
+    pytest.importorskip("pyarrow")
+    table = LogReader(self.fn).to_arrow("modelV2", ["position.x"])
+    assert table.num_rows == 10
+    assert table.column("position.x").to_pylist()[3] == pytest.approx([3 + j for j in range(33)])
+
+  def test_ragged_lists_rejected(self):
+    with pytest.raises(ValueError, match="laneLineProbs has lists of different lengths"):
+      LogReader(self.fn).to_numpy("modelV2", ["laneLineProbs"])
+
+  @pytest.mark.parametrize("field", ["buttonEvents", "cruiseState", "buttonEvents.pressed", "noSuchField", "vEgo.x"])
+  def test_non_column_fields_rejected(self, field):
+    with pytest.raises(ValueError, match=field):
+      LogReader(self.fn).to_numpy("carState", [field])
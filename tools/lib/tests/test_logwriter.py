@@ -0,0 +1,39 @@
+import pytest
+
+from cereal import log as capnp_log
+from openpilot.tools.lib.logreader import LogReader, save_log
+from openpilot.tools.lib.logwriter import WRITE_CHUNK_SIZE, LogWriter
+
+
+def make_events(n):
+  events = []
+  for i in range(n):
+    msg = capnp_log.Event.new_message(logMonoTime=i)
+    msg.init("carState").vEgo = i
+    events.append(msg)
+  return events
+
+
+class TestLogWriter:
+  @pytest.mark.parametrize("ext", ["", ".bz2", ".zst"])
+  @pytest.mark.parametrize("stream", [False, True])
+  def test_round_trip(self, tmp_path, ext, stream):
+    fn = str(tmp_path / f"rlog{ext}")
+    events = make_events(10000)
+    with LogWriter(fn) as writer:
+      writer.write(events[0])
+      writer.write(events[1].as_reader())
+      writer.write(events[2].to_bytes())
+      # large blocks skip the buffer
+      big = b"".join(e.to_bytes() for e in events[3:])
+      assert len(big) > WRITE_CHUNK_SIZE
+      writer.write(big)
+
+    lr = LogReader(fn, stream=stream)
+    assert [(m.logMonoTime, m.carState.vEgo) for m in lr] == [(i, i) for i in range(10000)]
+
+  @pytest.mark.parametrize("ext", ["", ".bz2", ".zst"])
+  def test_save_log(self, tmp_path, ext):
+    fn = str(tmp_path / f"rlog{ext}")
+    save_log(fn, make_events(10))
+    assert [m.logMonoTime for m in LogReader(fn)] == list(range(10))
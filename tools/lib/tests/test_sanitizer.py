@@ -0,0 +1,44 @@
+import os
+import pytest
+
+from cereal import log as capnp_log
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.logwriter import LogWriter
+from openpilot.tools.lib.sanitizer import sanitize_raw, sanitize_route, segment_num
+
+VIN = "1HGCM82633A004352"
+
+
+def make_events():
+  car_params = capnp_log.Event.new_message(logMonoTime=1)
+  car_params.init("carParams").carVin = VIN
+  return [car_params, capnp_log.Event.new_message(logMonoTime=2, carState={}),
+          capnp_log.Event.new_message(logMonoTime=3, can=[{"address": 1}])]
+
+
+class TestSanitizer:
+  def test_sanitize_raw(self):
+    events = list(sanitize_raw(e.to_bytes() for e in make_events()))
+    assert len(events) == 2
+    with capnp_log.Event.from_bytes(events[0]) as msg:
+      assert msg.carParams.carVin == VIN[:-6] + "XXXXXX"
+    assert events[1] == make_events()[2].to_bytes()
+
+  @pytest.mark.parametrize("src, seg", [
+    ("cd:/a2a0ccea32023010/2023-07-27--13-01-19/3/rlog.bz2", 3),
+    ("https://commadataci.blob.core.windows.net/openpilotci/a2a0ccea32023010/2023-07-27--13-01-19/12/rlog.zst?sig=x", 12),
+    ("/data/media/0/realdata/2023-07-27--13-01-19--5/rlog", 5),
+    ("/tmp/rlog.bz2", None),
+  ])
+  def test_segment_num(self, src, seg):
+    assert segment_num(src) == seg
+
+  def test_route_named_by_segment(self, tmp_path):
+    src = tmp_path / "2023-07-27--13-01-19--4" / "rlog.zst"
+    os.makedirs(src.parent)
+    with LogWriter(str(src)) as writer:
+      writer.write_all(make_events())
+
+    dests = sanitize_route(str(src), str(tmp_path / "sanitized"), num_processes=1)
+    assert dests == [str(tmp_path / "sanitized" / "4--rlog.zst")]
+    assert [m.which() for m in LogReader(dests[0])] == ["carParams", "can"]
@@ -0,0 +1,57 @@
+import os
+
+from openpilot.tools.lib import url_file_cache
+from openpilot.tools.lib.url_file_cache import URLFileCache, cache_written, evict_cache
+
+CHUNK_SIZE = 4096
+
+
+def fill(root, key, num_chunks):
+  cache = URLFileCache(str(root), key, CHUNK_SIZE)
+  cache.set_length(num_chunks * CHUNK_SIZE)
+  cache.put_chunks(dict.fromkeys(range(num_chunks), b"\x01" * CHUNK_SIZE))
+  return cache
+
+
+class TestURLFileCache:
+  def test_evict_under_budget_keeps_everything(self, tmp_path):
+    for i in range(4):
+      fill(tmp_path, f"{i:064x}", 2)
+    size = evict_cache(str(tmp_path), max_size=100 * CHUNK_SIZE)
+    assert size >= 8 * CHUNK_SIZE
+    assert len(os.listdir(tmp_path)) == 8
+
+  def test_evict_down_to_target(self, tmp_path):
+    for i in range(10):
+      cache = fill(tmp_path, f"{i:064x}", 1)
+      # oldest first
+      os.utime(cache._index_path, (i, i))
+    size = evict_cache(str(tmp_path), max_size=int(7.5 * CHUNK_SIZE))
+    assert size <= 7.5 * CHUNK_SIZE * url_file_cache.EVICT_TARGET
+    remaining = {fn[:64] for fn in os.listdir(tmp_path)}
+    assert f"{9:064x}" in remaining and f"{0:064x}" not in remaining
+
+  def test_cache_written_scans_only_when_over_headroom(self, tmp_path, monkeypatch):
+    monkeypatch.setattr(url_file_cache, "_budget", url_file_cache._CacheBudget())
+    scans = []
+    monkeypatch.setattr(url_file_cache, "evict_cache", lambda *args, **kwargs: scans.append(args) or 0)
+    cache_written(str(tmp_path), CHUNK_SIZE, max_size=10 * CHUNK_SIZE)
+    assert len(scans) == 1
+    for _ in range(9):
+      cache_written(str(tmp_path), CHUNK_SIZE, max_size=10 * CHUNK_SIZE)
+    assert len(scans) == 1
+    cache_written(str(tmp_path), CHUNK_SIZE, max_size=10 * CHUNK_SIZE)
+    assert len(scans) == 2
+
+  def test_evict_data_without_index(self, tmp_path):
+    # lock taken for a download that never saved its index
+    orphan = tmp_path / (f"{0:064x}" + url_file_cache.DATA_SUFFIX)
+    orphan.write_bytes(b"\x01" * 4 * CHUNK_SIZE)
+    os.utime(orphan, (0, 0))
+    fill(tmp_path, f"{1:064x}", 2)
+    assert evict_cache(str(tmp_path), max_size=100 * CHUNK_SIZE) >= 6 * CHUNK_SIZE
+
+    size = evict_cache(str(tmp_path), max_size=5 * CHUNK_SIZE)
+    assert size <= 5 * CHUNK_SIZE * url_file_cache.EVICT_TARGET
+    assert not orphan.exists()
+    assert len(os.listdir(tmp_path)) == 2
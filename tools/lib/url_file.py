@@ -2,16 +2,20 @@ import logging
 import os
 import socket
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashlib import sha256
 from urllib3 import PoolManager, Retry
 from urllib3.response import BaseHTTPResponse
 from urllib3.util import Timeout
 
-from openpilot.common.file_helpers import atomic_write_in_dir
 from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.url_file_cache import URLFileCache, cache_written
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
+#  Concurrent range requests per process, and how far ahead of sequential reads to download
+MAX_PARALLEL_DOWNLOADS = int(os.getenv("URLFILE_PARALLEL_DOWNLOADS", "8"))
+READAHEAD_SIZE = 4 * CHUNK_SIZE
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
@@ -26,10 +30,12 @@ class URLFileException(Exception):
 
 class URLFile:
   _pool_manager: PoolManager|None = None
+  _executor: ThreadPoolExecutor|None = None
 
   @staticmethod
   def reset() -> None:
     URLFile._pool_manager = None
+    URLFile._executor = None
 
   @staticmethod
   def pool_manager() -> PoolManager:
@@ -39,25 +45,37 @@ class URLFile:
       URLFile._pool_manager = PoolManager(num_pools=10, maxsize=100, socket_options=socket_options, retries=retries)
     return URLFile._pool_manager
 
+  @staticmethod
+  def executor() -> ThreadPoolExecutor:
+    #  Only runs single requests, so tasks never wait on each other
+    if URLFile._executor is None:
+      URLFile._executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_DOWNLOADS, thread_name_prefix="URLFile")
+    return URLFile._executor
+
   def __init__(self, url: str, timeout: int=10, debug: bool=False, cache: bool|None=None):
     self._url = url
     self._timeout = Timeout(connect=timeout, read=timeout)
     self._pos = 0
     self._length: int|None = None
     self._debug = debug
+    self._read_end: int|None = None
+    self._readahead: dict[int, tuple[int, Future[bytes]]] = {}
+    self._pending_chunks: dict[int, Future[bytes]] = {}
     #  True by default, false if FILEREADER_CACHE is defined, but can be overwritten by the cache input
     self._force_download = not int(os.environ.get("FILEREADER_CACHE", "0"))
     if cache is not None:
       self._force_download = not cache
 
+    self._cache: URLFileCache|None = None
     if not self._force_download:
       os.makedirs(Paths.download_cache_root(), exist_ok=True)
+      self._cache = URLFileCache(Paths.download_cache_root(), hash_256(url), CHUNK_SIZE)
 
   def __enter__(self):
     return self
 
   def __exit__(self, exc_type, exc_value, traceback) -> None:
-    pass
+    self._cancel_readahead()
 
   def _request(self, method: str, url: str, headers: dict[str, str]|None=None) -> BaseHTTPResponse:
     return URLFile.pool_manager().request(method, url, timeout=self._timeout, headers=headers)
@@ -73,63 +91,118 @@ class URLFile:
     if self._length is not None:
       return self._length
 
-    file_length_path = os.path.join(Paths.download_cache_root(), hash_256(self._url) + "_length")
-    if not self._force_download and os.path.exists(file_length_path):
-      with open(file_length_path) as file_length:
-        content = file_length.read()
-        self._length = int(content)
-        return self._length
+    if self._cache is not None and self._cache.length is not None:
+      self._length = self._cache.length
+      return self._length
 
     self._length = self.get_length_online()
-    if not self._force_download and self._length != -1:
-      with atomic_write_in_dir(file_length_path, mode="w") as file_length:
-        file_length.write(str(self._length))
+    if self._cache is not None and self._length != -1:
+      self._cache.set_length(self._length)
     return self._length
 
   def read(self, ll: int|None=None) -> bytes:
-    if self._force_download:
-      return self.read_aux(ll=ll)
+    sequential = self._pos == self._read_end
+    if not sequential:
+      self._cancel_readahead()
 
+    if self._force_download:
+      readahead = self._readahead.pop(self._pos, None)
+      if readahead is not None and readahead[0] == ll:
+        response = readahead[1].result()
+        self._pos += len(response)
+      else:
+        if readahead is not None:
+          readahead[1].cancel()
+        response = self.read_aux(ll=ll)
+      # reads of a fixed size following each other are fetched ahead
+      if sequential and ll is not None:
+        self._read_ahead(ll)
+    else:
+      response = self._read_cached(ll)
+      if sequential:
+        self._read_ahead_chunks()
+
+    self._read_end = self._pos
+    return response
+
+  def _read_cached(self, ll: int|None=None) -> bytes:
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
+    length = self.get_length()
+    assert length != -1, f"Remote file is empty or doesn't exist: {self._url}"
+    file_end = min(self._pos + ll, length) if ll is not None else length
+    if file_begin >= file_end:
+      return b""
     #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
+    first_chunk = file_begin // CHUNK_SIZE
+    chunks = self._get_chunks(range(first_chunk, (file_end - 1) // CHUNK_SIZE + 1))
+
+    response = b"".join(chunks)
+    offset = first_chunk * CHUNK_SIZE
+    self._pos = file_end
+    return response[file_begin - offset:file_end - offset]
+
+  def _cache_chunk(self, chunk_number: int) -> bytes:
+    assert self._cache is not None
+    start = chunk_number * CHUNK_SIZE
+    data = self._download_range(start, min(start + CHUNK_SIZE, self.get_length()))
+    self._cache.put_chunks({chunk_number: data})
+    cache_written(Paths.download_cache_root(), len(data))
+    return data
+
+  def _get_chunks(self, chunk_numbers: range) -> list[bytes]:
+    #  Download all missing chunks at once, then read the rest from the cache
+    assert self._cache is not None
+    futures = {n: self._pending_chunks.pop(n) for n in chunk_numbers if n in self._pending_chunks}
+    chunks = self._cache.get_chunks(n for n in chunk_numbers if n not in futures)
+    for n in chunk_numbers:
+      if n not in futures and n not in chunks:
+        futures[n] = URLFile.executor().submit(self._cache_chunk, n)
+
+    chunks.update({n: future.result() for n, future in futures.items()})
+    return [chunks[n] for n in chunk_numbers]
+
+  def _read_ahead(self, ll: int) -> None:
+    length = self.get_length()
+    for start in range(self._pos, min(self._pos + READAHEAD_SIZE, length), max(ll, 1))[:MAX_PARALLEL_DOWNLOADS]:
+      if start not in self._readahead:
+        self._readahead[start] = (ll, URLFile.executor().submit(self._download_range, start, min(start + ll, length)))
+
+  def _read_ahead_chunks(self) -> None:
+    assert self._cache is not None
+    first_chunk = -(-self._pos // CHUNK_SIZE)
+    last_chunk = -(-min(self._pos + READAHEAD_SIZE, self.get_length()) // CHUNK_SIZE)
+    for n in range(first_chunk, last_chunk):
+      if n not in self._pending_chunks and not self._cache.has_chunk(n):
+        self._pending_chunks[n] = URLFile.executor().submit(self._cache_chunk, n)
+
+  def _cancel_readahead(self) -> None:
+    for _, future in self._readahead.values():
+      future.cancel()
+    self._readahead.clear()
 
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
+  def read_aux(self, ll: int|None=None) -> bytes:
+    if self._pos == 0 and ll is None and self.get_length() <= CHUNK_SIZE:
+      ret = self._download_range(0, None)
+    else:
+      end = self.get_length() if ll is None else min(self._pos + ll, self.get_length())
+      ret = self._download_ranges(self._pos, end)
 
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+    self._pos += len(ret)
+    return ret
 
-  def read_aux(self, ll: int|None=None) -> bytes:
-    download_range = False
+  def _download_ranges(self, start: int, end: int) -> bytes:
+    #  Large reads are split into chunks downloaded in parallel
+    ranges = [(b, min(b + CHUNK_SIZE, end)) for b in range(start, end, CHUNK_SIZE)]
+    if len(ranges) <= 1:
+      return self._download_range(start, end) if len(ranges) else b""
+    return b"".join(URLFile.executor().map(lambda r: self._download_range(*r), ranges))
+
+  def _download_range(self, start: int, end: int|None) -> bytes:
+    #  Downloads [start, end), or the whole file without a range request if end is None
+    download_range = end is not None
     headers = {}
-    if self._pos != 0 or ll is not None:
-      if ll is None:
-        end = self.get_length() - 1
-      else:
-        end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
-        return b""
-      headers['Range'] = f"bytes={self._pos}-{end}"
-      download_range = True
+    if end is not None:
+      headers['Range'] = f"bytes={start}-{end - 1}"
 
     if self._debug:
       t1 = time.time()
@@ -150,7 +223,6 @@ class URLFile:
     if (not download_range) and response_code != 200:  # OK
       raise URLFileException(f"Error {response_code} {headers} ({self._url}): {repr(ret)[:500]}")
 
-    self._pos += len(ret)
     return ret
 
   def seek(self, pos:int) -> None:
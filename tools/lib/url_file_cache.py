@@ -0,0 +1,198 @@
+import contextlib
+import fcntl
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from openpilot.common.file_helpers import atomic_write_in_dir
+
+#  Bytes of downloaded data kept on disk, least recently used files are evicted past it
+MAX_CACHE_SIZE = int(os.getenv("FILEREADER_CACHE_SIZE", str(20 * 1024 ** 3)))
+#  Eviction goes down to this fraction of the budget, so there is room for a while before the next one
+EVICT_TARGET = 0.9
+
+DATA_SUFFIX = ".data"
+INDEX_SUFFIX = ".index"
+#  Files from before the cache had an index: one per chunk, plus one holding the length
+LEGACY_FILE = re.compile(r"^[0-9a-f]{64}_(length|[0-9]+\.0)$")
+
+
+class URLFileCache:
+  """
+  Downloaded chunks of one remote file. The chunks live in a single sparse data file at their offset in the remote
+  file, and a small index records the file length and which chunks are present. The data file is flock'ed while in
+  use, so other processes can read, write, and evict the same entries.
+  """
+
+  def __init__(self, root: str, key: str, chunk_size: int):
+    self.chunk_size = chunk_size
+    self._data_path = os.path.join(root, key + DATA_SUFFIX)
+    self._index_path = os.path.join(root, key + INDEX_SUFFIX)
+    self._length: int | None = None
+    self._chunks: set[int] = set()
+    self._load_index()
+
+  def _load_index(self) -> None:
+    try:
+      with open(self._index_path) as f:
+        index = json.load(f)
+      self._length, self._chunks = index['length'], set(index['chunks'])
+    except (OSError, ValueError, KeyError):
+      self._length, self._chunks = None, set()
+
+  def _save_index(self) -> None:
+    with atomic_write_in_dir(self._index_path, mode="w", overwrite=True) as f:
+      json.dump({'length': self._length, 'chunks': sorted(self._chunks)}, f)
+
+  @contextmanager
+  def _locked(self, exclusive: bool):
+    #  Lock the data file, making sure it wasn't evicted while waiting for the lock
+    while True:
+      fd = os.open(self._data_path, os.O_RDWR | os.O_CREAT, 0o644)
+      fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+      try:
+        if os.fstat(fd).st_ino == os.stat(self._data_path).st_ino:
+          break
+      except FileNotFoundError:
+        pass
+      os.close(fd)
+
+    try:
+      self._load_index()
+      yield fd
+    finally:
+      os.close(fd)
+
+  @property
+  def length(self) -> int | None:
+    return self._length
+
+  def set_length(self, length: int) -> None:
+    with self._locked(exclusive=True):
+      self._length = length
+      self._save_index()
+
+  def has_chunk(self, chunk_number: int) -> bool:
+    return chunk_number in self._chunks
+
+  def get_chunks(self, chunk_numbers) -> dict[int, bytes]:
+    """Cached chunks out of the requested ones"""
+    ret = {}
+    with self._locked(exclusive=False) as fd:
+      for n in chunk_numbers:
+        if n in self._chunks:
+          ret[n] = os.pread(fd, self._chunk_len(n), n * self.chunk_size)
+      if len(ret):
+        os.utime(self._index_path)
+    return ret
+
+  def put_chunks(self, chunks: dict[int, bytes]) -> None:
+    with self._locked(exclusive=True) as fd:
+      for n, data in chunks.items():
+        os.pwrite(fd, data, n * self.chunk_size)
+      self._chunks.update(chunks.keys())
+      self._save_index()
+
+  def _chunk_len(self, chunk_number: int) -> int:
+    if self._length is None:
+      return self.chunk_size
+    return min(self.chunk_size, self._length - chunk_number * self.chunk_size)
+
+
+class _CacheBudget:
+  """Bytes this process added to the cache since it last measured it, against the room that was left then"""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.written = 0
+    self.headroom = 0
+
+
+_budget = _CacheBudget()
+
+
+def _reset_budget() -> None:
+  global _budget
+  _budget = _CacheBudget()
+
+
+os.register_at_fork(after_in_child=_reset_budget)
+
+
+def cache_written(root: str, size: int, max_size: int = MAX_CACHE_SIZE) -> None:
+  """Account for size bytes added to the cache, and evict once it may have gone over max_size"""
+  budget = _budget
+  with budget.lock:
+    budget.written += size
+    if budget.written < budget.headroom:
+      return
+    #  other processes fill the same cache, it's measured again rather than tracked
+    budget.written = 0
+    budget.headroom = max(max_size - evict_cache(root, max_size), 0)
+
+
+def evict_cache(root: str, max_size: int = MAX_CACHE_SIZE) -> int:
+  """
+  Once the cache's data takes up more than max_size bytes, delete the least recently used files until it's down to
+  EVICT_TARGET of it. Returns the size left
+  """
+  keys = set()
+  for fn in os.listdir(root):
+    path = os.path.join(root, fn)
+    if LEGACY_FILE.match(fn):
+      try:
+        os.unlink(path)
+      except FileNotFoundError:
+        pass
+    elif fn.endswith((DATA_SUFFIX, INDEX_SUFFIX)):
+      keys.add(os.path.splitext(path)[0])
+
+  entries = []
+  total_size = 0
+  for key in keys:
+    index_path, data_path = key + INDEX_SUFFIX, key + DATA_SUFFIX
+    try:
+      size = os.stat(data_path).st_blocks * 512
+    except FileNotFoundError:
+      size = 0
+    try:
+      last_used = os.stat(index_path).st_mtime
+    except FileNotFoundError:
+      #  data file locked but no index ever written for it, e.g. the download failed
+      try:
+        last_used = os.stat(data_path).st_mtime
+      except FileNotFoundError:
+        continue
+    entries.append((last_used, index_path, data_path, size))
+    total_size += size
+
+  if total_size <= max_size:
+    return total_size
+
+  for _, index_path, data_path, size in sorted(entries):
+    if total_size <= max_size * EVICT_TARGET:
+      break
+
+    try:
+      fd = os.open(data_path, os.O_RDONLY)
+    except FileNotFoundError:
+      fd = None
+
+    try:
+      if fd is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      with contextlib.suppress(FileNotFoundError):
+        os.unlink(index_path)
+      if fd is not None:
+        os.unlink(data_path)
+      total_size -= size
+    except (BlockingIOError, FileNotFoundError):
+      #  in use, or already evicted by someone else
+      pass
+    finally:
+      if fd is not None:
+        os.close(fd)
+
+  return total_size
@@ -2,8 +2,11 @@
 import argparse
 import os
 import struct
+from collections.abc import Iterator
 from enum import IntEnum
 
+import numpy as np
+
 from openpilot.tools.lib.filereader import FileReader
 
 DEBUG = int(os.getenv("DEBUG", "0"))
@@ -17,6 +20,7 @@ DEBUG = int(os.getenv("DEBUG", "0"))
 NAL_UNIT_START_CODE = b"\x00\x00\x01"
 NAL_UNIT_START_CODE_SIZE = len(NAL_UNIT_START_CODE)
 NAL_UNIT_HEADER_SIZE = 2
+READ_BLOCK_SIZE = 8 * 1024 * 1024
 
 class HevcNalUnitType(IntEnum):
   TRAIL_N = 0         # RBSP structure: slice_segment_layer_rbsp( )
@@ -258,38 +262,144 @@ def get_hevc_slice_type(dat: bytes, nal_unit_start: int, nal_unit_type: HevcNalU
     raise VideoFileInvalid("slice_type must be 0, 1, or 2")
   return slice_type, is_first_slice
 
-def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
-  with FileReader(hevc_file_name) as f:
-    dat = f.read()
-
-  if len(dat) < NAL_UNIT_START_CODE_SIZE + 1:
-    raise VideoFileInvalid("data is too short")
-
-  if dat[0] != 0x00:
-    raise VideoFileInvalid("first byte must be 0x00")
+def find_nal_unit_starts(dat, start: int = 0) -> list[int]:
+  """Index of every NAL unit start code in dat beginning at or after start"""
+  arr = np.frombuffer(dat, dtype=np.uint8)
+  # ones are rare in compressed data, so only their neighbours need checking
+  ones = np.flatnonzero(arr[start + 2:] == 1) + start + 2
+  ones = ones[(arr[ones - 1] == 0) & (arr[ones - 2] == 0)]
+  starts: list[int] = (ones - 2).tolist()
+  return starts
+
+def iter_nal_units(f, block_size: int = READ_BLOCK_SIZE) -> Iterator[tuple[int, bytes]]:
+  """Offset and data (start code included) of each NAL unit in an annex B byte stream, read from f in blocks"""
+  buf = bytearray()
+  buf_offset = 0  # offset of buf in the stream
+  nal_start = None
+  scanned = 0  # start codes beginning before this are already found
+  while True:
+    block = f.read(block_size)
+    buf += block
+    for start in find_nal_unit_starts(buf, scanned):
+      if nal_start is not None:
+        yield buf_offset + nal_start, bytes(buf[nal_start:start])
+      nal_start = start
+    # the last two bytes might be the beginning of a start code
+    scanned = max(len(buf) - NAL_UNIT_START_CODE_SIZE + 1, scanned)
+
+    if nal_start:
+      del buf[:nal_start]
+      buf_offset += nal_start
+      scanned -= nal_start
+      nal_start = 0
+
+    if len(block) == 0:
+      break
+
+  if nal_start is not None:
+    yield buf_offset + nal_start, bytes(buf[nal_start:])
 
+def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
   prefix_dat = b""
   frame_types = list()
 
-  i = 1 # skip past first byte 0x00
-  try:
-    while i < len(dat):
-      require_nal_unit_start(dat, i)
-      nal_unit_len = get_hevc_nal_unit_length(dat, i)
-      nal_unit_type = get_hevc_nal_unit_type(dat, i)
-      if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
-        prefix_dat += dat[i:i+nal_unit_len]
-      elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
-        slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
-        if is_first_slice:
-          frame_types.append((slice_type, i))
-      i += nal_unit_len
-  except Exception as e:
-    if not allow_corrupt:
-      raise
-    print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
-
-  return frame_types, len(dat), prefix_dat
+  with FileReader(hevc_file_name) as f:
+    header = f.read(NAL_UNIT_START_CODE_SIZE + 1)
+    if len(header) < NAL_UNIT_START_CODE_SIZE + 1:
+      raise VideoFileInvalid("data is too short")
+
+    if header[0] != 0x00:
+      raise VideoFileInvalid("first byte must be 0x00")
+    require_nal_unit_start(header, 1)
+
+    f.seek(0)
+    nal_units = iter_nal_units(f)
+    i = 1
+    dat_len = 0
+    try:
+      for i, nal_unit in nal_units:
+        dat_len = i + len(nal_unit)
+        nal_unit_type = get_hevc_nal_unit_type(nal_unit, 0)
+        if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
+          prefix_dat += nal_unit
+        elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
+          slice_type, is_first_slice = get_hevc_slice_type(nal_unit, 0, nal_unit_type)
+          if is_first_slice:
+            frame_types.append((slice_type, i))
+    except Exception as e:
+      if not allow_corrupt:
+        raise
+      print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
+      # length of the whole file, even though parsing stopped early
+      for i, nal_unit in nal_units:
+        dat_len = i + len(nal_unit)
+
+  return frame_types, dat_len, prefix_dat
+
+def get_rbsp(nal_unit: bytes) -> bytes:
+  # 7.4.2 NAL unit semantics: emulation_prevention_three_byte (0x03 after two zero bytes) is not part of the RBSP
+  return nal_unit[NAL_UNIT_START_CODE_SIZE + NAL_UNIT_HEADER_SIZE:].replace(b"\x00\x00\x03", b"\x00\x00")
+
+class BitReader:
+  def __init__(self, dat: bytes):
+    self.dat = dat
+    self.pos = 0
+
+  def u(self, n: int) -> int:
+    val = 0
+    for _ in range(n):
+      if self.pos >= len(self.dat) * 8:
+        raise VideoFileInvalid("read past the end of the rbsp")
+      val = (val << 1) | (self.dat[self.pos // 8] >> (7 - self.pos % 8)) & 1
+      self.pos += 1
+    return val
+
+  def ue(self) -> int:
+    leading_zeros = 0
+    while self.u(1) == 0:
+      leading_zeros += 1
+    return (1 << leading_zeros) - 1 + self.u(leading_zeros)
+
+def get_hevc_sps_dimensions(nal_unit: bytes) -> tuple[int, int]:
+  # 7.3.2.2.1 General sequence parameter set RBSP syntax, up to the conformance window
+  r = BitReader(get_rbsp(nal_unit))
+  r.u(4)  # sps_video_parameter_set_id
+  max_sub_layers_minus1 = r.u(3)
+  r.u(1)  # sps_temporal_id_nesting_flag
+
+  # 7.3.3 Profile, tier and level syntax
+  r.u(96)  # general profile, tier, compatibility flags, constraint flags and level
+  sub_layer_flags = [(r.u(1), r.u(1)) for _ in range(max_sub_layers_minus1)]
+  if max_sub_layers_minus1 > 0:
+    r.u(2 * (8 - max_sub_layers_minus1))  # reserved_zero_2bits
+  for profile_present, level_present in sub_layer_flags:
+    r.u(88 * profile_present + 8 * level_present)
+
+  r.ue()  # sps_seq_parameter_set_id
+  chroma_format_idc = r.ue()
+  if chroma_format_idc == 3:
+    r.u(1)  # separate_colour_plane_flag
+  width = r.ue()  # pic_width_in_luma_samples
+  height = r.ue()  # pic_height_in_luma_samples
+
+  # 7.4.3.2.1 the conformance window is in chroma samples, Table 6-1 gives SubWidthC and SubHeightC
+  if r.u(1):  # conformance_window_flag
+    sub_width_c, sub_height_c = {1: (2, 2), 2: (2, 1)}.get(chroma_format_idc, (1, 1))
+    left, right, top, bottom = r.ue(), r.ue(), r.ue(), r.ue()
+    width -= sub_width_c * (left + right)
+    height -= sub_height_c * (top + bottom)
+
+  if DEBUG:
+    print("  sps dimensions:", width, height)
+  return width, height
+
+def hevc_dimensions(prefix_dat: bytes) -> tuple[int, int] | None:
+  """Width and height of the video from the SPS within the parameter sets returned by hevc_index, if there is one"""
+  starts = find_nal_unit_starts(prefix_dat)
+  for start, end in zip(starts, starts[1:] + [len(prefix_dat)], strict=True):
+    if get_hevc_nal_unit_type(prefix_dat, start) == HevcNalUnitType.SPS_NUT:
+      return get_hevc_sps_dimensions(prefix_dat[start:end])
+  return None
 
 def main() -> None:
   parser = argparse.ArgumentParser()
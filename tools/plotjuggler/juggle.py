@@ -10,9 +10,13 @@ import requests
 import argparse
 from functools import partial
 
+from cereal import log as capnp_log
 from opendbc.car.fingerprints import MIGRATION
 from openpilot.common.basedir import BASEDIR
-from openpilot.tools.lib.logreader import LogReader, ReadMode, save_log
+from openpilot.tools.lib.log_framing import EVENT_TYPES
+from openpilot.tools.lib.log_index import read_event_header
+from openpilot.tools.lib.logreader import LogReader, ReadMode
+from openpilot.tools.lib.logwriter import LogWriter
 
 juggle_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -73,28 +77,44 @@ def start_juggler(fn=None, dbc=None, layout=None, route_or_segment_name=None):
 
 
 def process(can, lr):
-  return [d for d in lr if can or d.which() not in ['can', 'sendcan']]
+  # events are passed on as raw bytes, only carParams is decoded to find the DBC
+  dbc = None
+  events = []
+  for dat in lr.iter_raw():
+    which = EVENT_TYPES.get(read_event_header(dat)[1])
+    if which == 'carParams' and dbc is None:
+      with capnp_log.Event.from_bytes(dat) as cp:
+        dbc = get_dbc(cp)
+    if can or which not in ['can', 'sendcan']:
+      events.append(dat)
+  return dbc, b"".join(events)
+
+
+def get_dbc(cp):
+  try:
+    DBC = __import__(f"opendbc.car.{cp.carParams.carName}.values", fromlist=['DBC']).DBC
+    fingerprint = cp.carParams.carFingerprint
+    return DBC[MIGRATION.get(fingerprint, fingerprint)]['pt']
+  except Exception:
+    return None
 
 
 def juggle_route(route_or_segment_name, can, layout, dbc=None):
   sr = LogReader(route_or_segment_name, default_mode=ReadMode.AUTO_INTERACTIVE)
 
-  all_data = sr.run_across_segments(24, partial(process, can))
-
-  # Infer DBC name from logs
-  if dbc is None:
-    for cp in [m for m in all_data if m.which() == 'carParams']:
-      try:
-        DBC = __import__(f"opendbc.car.{cp.carParams.carName}.values", fromlist=['DBC']).DBC
-        fingerprint = cp.carParams.carFingerprint
-        dbc = DBC[MIGRATION.get(fingerprint, fingerprint)]['pt']
-      except Exception:
-        pass
-      break
-
   with tempfile.NamedTemporaryFile(suffix='.rlog', dir=juggle_dir) as tmp:
-    save_log(tmp.name, all_data, compress=False)
-    del all_data
+    # write out each segment as soon as it's processed instead of holding the whole route in memory
+    seen_car_params = dbc is not None
+    with LogWriter(tmp.name) as writer:
+      for segment_dbc, dat in sr.iter_across_segments(24, partial(process, can)):
+        # Infer DBC name from logs
+        if not seen_car_params and segment_dbc is not None:
+          seen_car_params = True
+          dbc = segment_dbc
+
+        writer.write(dat)
+        del dat
+
     start_juggler(tmp.name, dbc, layout, route_or_segment_name)
 
 